@@ -204,8 +204,7 @@ class MovementAction(ActionWithDirection):
                     return
 
                 if item.token:
-                    for _ in range(0, item.count):
-                        self.entity.inventory.add_token(item.token)
+                    self.entity.inventory.add_token(item.token, item.count)
                 elif item.spell:
                     self.entity.magic.spell_inventory.other_spell.append(item.spell)
                 removed.add(item)
@@ -214,7 +213,9 @@ class MovementAction(ActionWithDirection):
                     self.engine.message_log.add_message(f"You picked up the {item.name}!")
 
 
-        self.engine.game_map.entities = self.engine.game_map.entities.difference(removed)
+        for item in removed:
+            self.engine.game_map.entities.remove(item)
+            entity_factories.release(item)
 
 
 class BumpAction(ActionWithDirection):
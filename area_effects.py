@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from typing import List, TYPE_CHECKING
+
+import numpy as np
+from tcod.los import bresenham
+
+import tile_types
+from stamping import disc_mask
+from tile_types import TileLabel
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from game_map import GameMap
+
+
+class Area:
+    """The cells within `radius` of `center`, clipped to the map.
+
+    `region` slices the map down to the disc's bounding box and `mask`
+    selects the disc inside it, so tile changes are one masked assignment
+    on a view of `game_map.tiles`.
+    """
+
+    def __init__(self, game_map: GameMap, center, radius: int):
+        self.game_map = game_map
+        self.center = center
+        self.radius = radius
+
+        (x, y) = center
+        x1 = min(max(0, x - radius), game_map.width)
+        y1 = min(max(0, y - radius), game_map.height)
+        x2 = max(x1, min(game_map.width, x + radius + 1))
+        y2 = max(y1, min(game_map.height, y + radius + 1))
+        self.origin = (x1, y1)
+        self.region = (slice(x1, x2), slice(y1, y2))
+        self.mask = disc_mask(radius)[
+            x1 - x + radius : x2 - x + radius,
+            y1 - y + radius : y2 - y + radius,
+        ]
+
+    def actors(self) -> List[Actor]:
+        """Return the living actors in the area, ordered by x then y."""
+        self.game_map.colony.materialize_mask(self.mask, self.origin)
+        actors, xs, ys = self.game_map.actor_positions()
+        dx = xs - self.center[0]
+        dy = ys - self.center[1]
+        hit = np.flatnonzero(dx * dx + dy * dy <= self.radius * self.radius)
+        hit = hit[np.lexsort((ys[hit], xs[hit]))]
+        return [actors[i] for i in hit]
+
+    def carve_walls(self) -> None:
+        """Turn every wall in the area into floor."""
+        tiles = self.game_map.tiles[self.region]
+        walls = self.mask & (tiles["label"] == TileLabel.Wall)
+        if walls.any():
+            tiles[walls] = tile_types.floor
+            self.game_map.terrain_changed()
+
+    def build(self, tile: np.ndarray) -> None:
+        """Put `tile` on every cell of the area no living actor stands on."""
+        cells = self.mask & ~self.game_map.colony.member[self.region]
+        (x1, y1) = self.origin
+        _, xs, ys = self.game_map.actor_positions()
+        xs = xs - x1
+        ys = ys - y1
+        inside = (xs >= 0) & (xs < cells.shape[0]) & (ys >= 0) & (ys < cells.shape[1])
+        cells[xs[inside], ys[inside]] = False
+        if cells.any():
+            self.game_map.tiles[self.region][cells] = tile
+            self.game_map.terrain_changed()
+
+
+class LineTraces:
+    """Bresenham lines between cells, kept for the rest of the turn.
+
+    A beam spell traces the same caster to target line for every effect it
+    applies, and every monster bumping the player traces the same short
+    lines turn after turn, so lines are computed once per turn and handed
+    out as read-only (xs, ys) index arrays.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lines = {}
+        self.turn = None
+
+    def trace(self, source, target):
+        turn = self.engine.turn
+        if turn != self.turn or len(self.lines) > 1024:
+            self.lines.clear()
+            self.turn = turn
+
+        key = (tuple(source), tuple(target))
+        line = self.lines.get(key)
+        if line is None:
+            points = bresenham(key[0], key[1]).astype(np.intp)
+            xs = points[:, 0]
+            ys = points[:, 1]
+            xs.flags.writeable = False
+            ys.flags.writeable = False
+            line = self.lines[key] = (xs, ys)
+        return line
+
+
+def clip_line(game_map: GameMap, xs: np.ndarray, ys: np.ndarray):
+    """Drop the points of a line that fall outside the map."""
+    inside = (xs >= 0) & (xs < game_map.width) & (ys >= 0) & (ys < game_map.height)
+    if inside.all():
+        return (xs, ys)
+    return (xs[inside], ys[inside])
+
+
+def actors_on_line(game_map: GameMap, xs: np.ndarray, ys: np.ndarray) -> List[Actor]:
+    """Return the living actors standing on the line, ordered along it."""
+    game_map.colony.materialize_cells(xs, ys)
+    actors, axs, ays = game_map.actor_positions()
+    line_cells = xs * game_map.height + ys
+    actor_cells = axs * game_map.height + ays
+    on_line = np.flatnonzero(np.isin(actor_cells, line_cells))
+    # Order by position along the line rather than by entity order.
+    steps = {cell: i for (i, cell) in enumerate(line_cells.tolist())}
+    return sorted((actors[i] for i in on_line), key=lambda a: steps[a.x * game_map.height + a.y])
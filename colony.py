@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import random
+from typing import List, Optional, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from game_map import GameMap
+
+# Chance per turn that a mushroom spawns another next to it, as in the
+# SpawnerAI every mushroom actor gets.
+SPAWN_CHANCE = 0.01
+# Dormant mushrooms a floor holds before it stops growing.
+DEFAULT_CAP = 150
+
+
+class MushroomColony:
+    """Every dormant mushroom on a map, kept as arrays instead of Actors.
+
+    `member` marks the cells holding a mushroom, `woody` which of them are
+    woody and `chance` the woody chance each passes on to its spawn. The
+    whole colony grows with one draw per turn over its frontier. A mushroom
+    only becomes an Actor once something interacts with it, see
+    `materialize`, and then stays one.
+    """
+
+    def __init__(self, game_map: GameMap, cap: int = DEFAULT_CAP):
+        self.game_map = game_map
+        self.cap = cap
+        shape = (game_map.width, game_map.height)
+        self.member = np.zeros(shape, dtype=bool, order="F")
+        self.woody = np.zeros(shape, dtype=bool, order="F")
+        self.chance = np.zeros(shape, dtype=np.float32, order="F")
+        self.count = 0
+
+    def add(self, x: int, y: int, woody: bool, chance: float) -> None:
+        if not self.member[x, y]:
+            self.count += 1
+        self.member[x, y] = True
+        self.woody[x, y] = woody
+        self.chance[x, y] = chance
+
+    def take(self, actor: Actor, x: int, y: int, force: bool = False) -> bool:
+        """Let the colony take a newly made `actor` that would go at (x, y).
+
+        Returns False for anything that isn't a mushroom, which the caller
+        then places itself. Mushrooms past the cap are dropped unless
+        `force` is set. Either way a mushroom actor goes back to its pool.
+        """
+        import entity_factories
+
+        traits = entity_factories.mushroom_traits(actor)
+        if traits is None:
+            return False
+        if force or self.count < self.cap:
+            self.add(x, y, *traits)
+        entity_factories.release(actor)
+        return True
+
+    def materialize(self, x: int, y: int) -> Optional[Actor]:
+        """Turn the dormant mushroom at (x, y) into an Actor on the map."""
+        import entity_factories
+
+        if not self.game_map.in_bounds(x, y) or not self.member[x, y]:
+            return None
+        self.member[x, y] = False
+        self.count -= 1
+        actor = entity_factories.mushroom_actor(bool(self.woody[x, y]), float(self.chance[x, y]))
+        actor.place(x, y, self.game_map)
+        return actor
+
+    def materialize_cells(self, xs: np.ndarray, ys: np.ndarray) -> List[Actor]:
+        """Materialize every dormant mushroom among the given cells."""
+        hit = self.member[xs, ys]
+        return [self.materialize(x, y) for (x, y) in zip(xs[hit].tolist(), ys[hit].tolist())]
+
+    def materialize_mask(self, mask: np.ndarray, origin=(0, 0)) -> List[Actor]:
+        """Materialize the mushrooms under `mask`, a window placed at `origin`."""
+        (x1, y1) = origin
+        (w, h) = mask.shape
+        (xs, ys) = np.nonzero(mask & self.member[x1 : x1 + w, y1 : y1 + h])
+        return [self.materialize(x, y) for (x, y) in zip((xs + x1).tolist(), (ys + y1).tolist())]
+
+    def frontier(self) -> np.ndarray:
+        """Members with at least one neighbor they could spawn onto."""
+        open_cells = np.pad(self.game_map.tiles["walkable"] & ~self.member, 1)
+        w, h = self.member.shape
+        has_room = np.zeros_like(self.member)
+        for dx in (0, 1, 2):
+            for dy in (0, 1, 2):
+                if (dx, dy) != (1, 1):
+                    has_room |= open_cells[dx : dx + w, dy : dy + h]
+        return self.member & has_room
+
+    def grow(self) -> None:
+        """Give every mushroom on the frontier its chance to spawn."""
+        if self.count >= self.cap:
+            return
+        (xs, ys) = np.nonzero(self.frontier())
+        # One batched draw, from a generator seeded off `random` like the
+        # rest of the game so one seed covers it.
+        rng = np.random.default_rng(random.getrandbits(64))
+        spawning = np.flatnonzero(rng.random(len(xs)) < SPAWN_CHANCE).tolist()
+        if not spawning:
+            return
+
+        placement = self.game_map.placement
+        for i in spawning:
+            if self.count >= self.cap:
+                break
+            cells = placement.cells_near(int(xs[i]), int(ys[i]), 1)
+            if not cells:
+                continue
+            (x, y) = cells[0]
+            chance = float(self.chance[xs[i], ys[i]])
+            woody = random.random() < chance
+            self.add(x, y, woody, chance + 0.1 if woody else chance - 0.05)
@@ -51,19 +51,21 @@ class BaseAI(Action):
         # Convert from List[List[int]] to List[Tuple[int, int]].
         return [(index[0], index[1]) for index in path]
 
+    def can_reach(self, x: int, y: int) -> bool:
+        """Return True if walkable ground leads from this actor to (x, y)."""
+        return self.engine.game_map.regions.connected((self.entity.x, self.entity.y), (x, y))
+
 
 class Familiar(BaseAI):
     def __init__(self, entity: Actor):
         self.entity = entity
 
     def perform(self) -> None:
-        for item in self.entity.inventory.items:
-            for _ in range(item.count):
-                self.engine.player.inventory.add_token(item.token)
+        self.engine.player.inventory.add_tokens(self.entity.inventory.take_tokens())
         for spell in self.entity.magic.spell_inventory.other_spell:
             self.engine.player.magic.spell_inventory.other_spell.append(spell)
         self.entity.magic.spell_inventory.other_spell.clear()
-        self.entity.inventory.items.clear()
+        self.entity.inventory.clear()
 
         player_weight = 1
         token_weight = 1
@@ -81,6 +83,10 @@ class Familiar(BaseAI):
             player_weight = 100
             token_weight = 0
             wiggle_weight = 0
+        if not self.can_reach(self.engine.player.x, self.engine.player.y):
+            # Following the player would only lead into a dead end.
+            player_weight = 0
+            token_weight = 1
 
         dist = self.engine.pathing.token_flow * token_weight + self.engine.pathing.player_flow * player_weight + (self.engine.pathing.random_flow + 100) * wiggle_weight
         path = self.engine.pathing.path_along_flow(dist, self.entity.x, self.entity.y)
@@ -107,20 +113,12 @@ class SpawnerAI(BaseAI):
 
     def perform(self) -> None:
         if random.random() < self.prob:
-            drop_targets = []
-            for dx in range(-1, 2):
-                for dy in range(-1, 2):
-                    x = self.entity.x + dx
-                    y = self.entity.y + dy
-                    if x >= 0 and x < self.engine.game_map.width and y >= 0 and y < self.engine.game_map.height and self.engine.game_map.tiles["walkable"][x,y]:
-                        if not self.engine.game_map.get_blocking_entity_at_location(x,y):
-                            drop_targets.append((x,y))
-            if drop_targets:
-                (x,y) = random.choice(drop_targets)
+            cells = self.engine.game_map.placement.cells_near(self.entity.x, self.entity.y, 1)
+            if cells:
+                (x, y) = cells[0]
                 new_entity = self.spawn_fn()
-                new_entity.x = x
-                new_entity.y = y
-                new_entity.spawn(self.engine.game_map, x, y)
+                if not self.engine.game_map.colony.take(new_entity, x, y):
+                    new_entity.place(x, y, self.engine.game_map)
 
 class HostileEnemy(BaseAI):
     def __init__(self, entity: Actor):
@@ -137,8 +135,8 @@ class HostileEnemy(BaseAI):
 
         path = None
         spell = self.entity.magic.spell_inventory.bump_spell
-        if spell and spell.can_cast(self.entity.inventory):
-            if self.engine.game_map.visible[self.entity.x, self.entity.y]:
+        if spell and self.entity.magic.can_cast(spell):
+            if self.engine.visibility.can_see(self.entity, target.x, target.y) and self.can_reach(target.x, target.y):
                 flow = self.engine.pathing.player_flow 
                 path = self.engine.pathing.path_along_flow(flow, self.entity.x, self.entity.y)
             else:
@@ -169,6 +167,8 @@ class CorruptedAvatar(BaseAI):
         if distance <= 1:
             return MeleeAction(self.entity, dx, dy).perform()
 
+        if not self.can_reach(target.x, target.y):
+            return WaitAction(self.entity).perform()
 
         flow = self.engine.pathing.player_flow 
         path = self.engine.pathing.path_along_flow(flow, self.entity.x, self.entity.y)
@@ -214,6 +214,17 @@ class RangedHostileEnemy(BaseAI):
     def __init__(self, entity: Actor, spell_fn = None):
         super().__init__(entity)
         self.spell_fn = spell_fn
+        # The spell_fn choice and the inventory token_version it was made for.
+        self.chosen_spell = None
+        self.chosen_for = None
+
+    def choose_spell(self):
+        """Return spell_fn's spell, asking again only once the tokens change."""
+        version = self.entity.inventory.token_version
+        if self.chosen_for != version:
+            self.chosen_spell = self.spell_fn(self.entity)
+            self.chosen_for = version
+        return self.chosen_spell
 
     def perform(self) -> None:
         target = self.engine.player
@@ -224,15 +235,16 @@ class RangedHostileEnemy(BaseAI):
         path = None
         spell = self.entity.magic.spell_inventory.ranged_spell
         if self.spell_fn:
-            spell = self.spell_fn(self.entity)
-        if self.engine.game_map.visible[self.entity.x, self.entity.y] and spell and spell.can_cast(self.entity.inventory):
+            spell = self.choose_spell()
+        can_see_target = self.engine.visibility.can_see(self.entity, target.x, target.y)
+        if can_see_target and spell and self.entity.magic.can_cast(spell):
             range = spell.attributes.get("range", 0)
             if distance <= 2:
                 path = self.engine.pathing.path_along_flow(self.engine.pathing.anti_player_flow, self.entity.x, self.entity.y)
             elif distance <= range:
                 return CastSpellAction(self.entity, spell, (target.x, target.y)).perform()
             else:
-                if self.engine.game_map.visible[self.entity.x, self.entity.y]:
+                if can_see_target and self.can_reach(target.x, target.y):
                     path = self.engine.pathing.path_along_flow(self.engine.pathing.player_flow, self.entity.x, self.entity.y)
                 else:
                     path = self.engine.pathing.path_along_flow(self.engine.pathing.random_flow, self.entity.x, self.entity.y)
@@ -4,6 +4,7 @@ from typing import Optional, TYPE_CHECKING
 
 import actions
 import color
+from area_effects import Area
 import components.ai
 import components.inventory
 from components.base_component import BaseComponent
@@ -37,7 +38,7 @@ class Consumable(BaseComponent):
         entity = self.parent
         inventory = entity.parent
         if isinstance(inventory, components.inventory.Inventory):
-            inventory.items.remove(entity)
+            inventory.remove_item(entity)
 
 
 class ConfusionConsumable(Consumable):
@@ -95,17 +96,22 @@ class FireballDamageConsumable(Consumable):
         if not self.engine.game_map.visible[target_xy]:
             raise Impossible("You cannot target an area that you cannot see.")
 
-        targets_hit = False
-        for actor in self.engine.game_map.actors:
-            if actor.distance(*target_xy) <= self.radius:
+        actors = Area(self.engine.game_map, target_xy, self.radius).actors()
+        if not actors:
+            raise Impossible("There are no targets in the radius.")
+
+        for actor in actors:
+            if actor.is_alive:
+                (outcome, amount) = actor.fighter.damage(self.damage, "fire")
+                if outcome == "damage":
+                    effect = f"taking {amount} damage"
+                elif outcome == "heal":
+                    effect = f"recovering {amount} HP"
+                else:
+                    effect = "to no effect"
                 self.engine.message_log.add_message(
-                    f"The {actor.name} is engulfed in a fiery explosion, taking {self.damage} damage!"
+                    f"The {actor.name} is engulfed in a fiery explosion, {effect}!"
                 )
-                actor.fighter.take_damage(self.damage)
-                targets_hit = True
-
-        if not targets_hit:
-            raise Impossible("There are no targets in the radius.")
         self.consume()
 
 
@@ -2,9 +2,7 @@ from __future__ import annotations
 from random import choice
 from math import ceil, isclose
 
-from typing import TYPE_CHECKING
-
-from entity import Item
+from typing import Tuple, TYPE_CHECKING
 
 import color
 from components.base_component import BaseComponent
@@ -67,6 +65,7 @@ class Fighter(BaseComponent):
             self.parent.char = "%"
             self.parent.color = (191, 0, 0)
             self.parent.blocks_movement = False
+            self.engine.game_map.placement.update(self.parent)
             self.parent.ai = None
             self.parent.name = f"remains of {self.parent.name}"
             self.parent.render_order = RenderOrder.CORPSE
@@ -94,19 +93,14 @@ class Fighter(BaseComponent):
             (x,y) = choice(drop_targets)
             item.x = x
             item.y = y
+            item.parent = self.engine.game_map
             self.engine.game_map.queue_add_entity(item)
         for spell in self.parent.magic.spell_inventory.all_spells():
             (x,y) = choice(drop_targets)
-            item = Item(
-                x=x,
-                y=y,
-                char = "~",
-                color = (255, 0, 255),
-                name = "spell",
-                spell = spell,
-            )
+            item = entity_factories.spell_item(x, y, spell)
+            item.parent = self.engine.game_map
             self.engine.game_map.queue_add_entity(item)
-        self.parent.inventory.items.clear()
+        self.parent.inventory.clear()
 
 
         self.engine.message_log.add_message(death_message, death_message_color)
@@ -141,33 +135,33 @@ class Fighter(BaseComponent):
         self.hp -= amount
         return amount
 
-    def damage(self, incoming_dmg: int, damage_type: str="untyped") -> str:
+    def damage(self, incoming_dmg: int, damage_type: str="untyped") -> Tuple[str, int]:
         """ Attempt to damage the Fighter
 
         This will check for resistances, etc. and may result in a heal.
-        It will return string indicating the outcome.
+        It returns an (outcome, amount) pair, where outcome is one of
+        "damage", "immune", "heal" or "nothing".
         """
         dmg_multiplier = self.dmg_multipliers.get("any")
 
         dmg_multiplier = self.dmg_multipliers.get(damage_type, dmg_multiplier)
 
         if dmg_multiplier is None:
-            return f"deals {self.decrease_hp(incoming_dmg)} damage"
+            return ("damage", self.decrease_hp(incoming_dmg))
 
         # Immunity (the only way 0 damage can be dealt)
         if isclose(dmg_multiplier, 0.0):
-            return "deals no damage"
+            return ("immune", 0)
 
         # Resistance and vulnerability
         if dmg_multiplier > 0.0:
             # ceil() ensures at least 1 damage unless immune
             modified_dmg = ceil(incoming_dmg * dmg_multiplier)
-            return f"deals {self.decrease_hp(modified_dmg)} damage"
+            return ("damage", self.decrease_hp(modified_dmg))
 
         # Healing
-        if dmg_multiplier < 0.0:
-            healed = self.increase_hp(ceil(incoming_dmg * -dmg_multiplier))
-            if healed != 0:
-                return f"heals for {self.increase_hp(healed)}"
-            else:
-                return "nothing happens"
+        healed = self.increase_hp(ceil(incoming_dmg * -dmg_multiplier))
+        if healed != 0:
+            return ("heal", healed)
+        else:
+            return ("nothing", 0)
@@ -1,12 +1,12 @@
 from __future__ import annotations
 
-from typing import List, TYPE_CHECKING
+from typing import Dict, Iterable, List, Mapping, Tuple, TYPE_CHECKING
 
 from components.base_component import BaseComponent
-from entity import Item
 
 if TYPE_CHECKING:
     from entity import Actor, Item
+    from components.magic.token import Token
 
 
 class Inventory(BaseComponent):
@@ -14,29 +14,101 @@ class Inventory(BaseComponent):
 
     def __init__(self):
         self.items: List[Item] = []
+        # Token stacks keyed by token id.  The counts here are authoritative,
+        # the stack Items in `items` mirror them for the inventory menu.
+        self.token_counts: Dict[int, int] = {}
+        self.token_items: Dict[int, Item] = {}
+        # Bumped on every change to the token counts.
+        self.token_version = 0
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Token ids depend on the order tokens were first built in, and
+        # loaded tokens re-intern theirs, so key the stacks by the new ids.
+        self.token_items = {item.token.token_id: item for item in self.items if item.token is not None}
+        self.token_counts = {token_id: item.count for (token_id, item) in self.token_items.items()}
 
     def drop(self, item: Item) -> None:
         """
         Removes an item from the inventory and restores it to the game map, at the player's current location.
         """
-        self.items.remove(item)
+        self.remove_item(item)
         item.place(self.parent.x, self.parent.y, self.gamemap)
 
         self.engine.message_log.add_message(f"You dropped the {item.name}.")
 
-    def add_token(self, token):
-        consumed = False
-        for other in self.items:
-            if other.token == token:
-                other.count += 1
-                consumed = True
-                break
-        if not consumed:
-            item = Item(
-                char = ".",
-                name = token.name,
-                count = 1,
-                token = token
-            )
+    def tokens_changed(self, token_ids: Iterable[int]) -> None:
+        """Let the owner's Magic know which token counts just changed."""
+        self.token_version += 1
+        magic = getattr(getattr(self, "parent", None), "magic", None)
+        if magic is not None:
+            magic.tokens_changed(token_ids)
+
+    def remove_item(self, item: Item) -> None:
+        self.items.remove(item)
+        if item.token is not None and self.token_items.get(item.token.token_id) is item:
+            del self.token_items[item.token.token_id]
+            del self.token_counts[item.token.token_id]
+            self.tokens_changed((item.token.token_id,))
+
+    def clear(self) -> None:
+        changed = list(self.token_counts)
+        self.items.clear()
+        self.token_counts.clear()
+        self.token_items.clear()
+        self.tokens_changed(changed)
+
+    def token_count(self, token_id: int) -> int:
+        return self.token_counts.get(token_id, 0)
+
+    def add_token(self, token: Token, count: int = 1) -> None:
+        token_id = token.token_id
+        item = self.token_items.get(token_id)
+        if item is None:
+            import entity_factories
+
+            item = entity_factories.token_item(token)
             item.parent = self
             self.items.append(item)
+            self.token_items[token_id] = item
+        item.count += count
+        self.token_counts[token_id] = item.count
+        self.tokens_changed((token_id,))
+
+    def add_tokens(self, tokens: Iterable[Tuple[Token, int]]) -> None:
+        """Add a (token, count) pair at a time, e.g. from Counter.items()."""
+        for (token, count) in tokens:
+            self.add_token(token, count)
+
+    def has_tokens(self, counts: Mapping[int, int]) -> bool:
+        """Return True if there are at least `counts` tokens of each id."""
+        return all(self.token_counts.get(token_id, 0) >= count for (token_id, count) in counts.items())
+
+    def remove_tokens(self, counts: Mapping[int, int]) -> bool:
+        """Remove `counts` tokens of each id, or nothing if any are missing."""
+        if not self.has_tokens(counts):
+            return False
+        import entity_factories
+
+        for (token_id, count) in counts.items():
+            item = self.token_items[token_id]
+            item.count -= count
+            if item.count <= 0:
+                self.items.remove(item)
+                del self.token_items[token_id]
+                del self.token_counts[token_id]
+                entity_factories.release(item)
+            else:
+                self.token_counts[token_id] = item.count
+        self.tokens_changed(counts)
+        return True
+
+    def take_tokens(self) -> List[Tuple[Token, int]]:
+        """Remove every token stack, returning them as (token, count) pairs."""
+        import entity_factories
+
+        taken = [(item.token, item.count) for item in self.token_items.values()]
+        for item in list(self.token_items.values()):
+            self.remove_item(item)
+            entity_factories.release(item)
+        return taken
@@ -6,6 +6,8 @@ from collections import Counter
 
 from typing import TYPE_CHECKING
 import copy
+import hashlib
+import weakref
 
 from spell_inventory import SpellInventory
 from components.base_component import BaseComponent
@@ -16,24 +18,135 @@ from components.magic.token import *
 if TYPE_CHECKING:
     from entity import Item
 
+# Most spells a Magic keeps cast counts for. Casters that keep choosing new
+# spells, like imps, would otherwise grow the table without end; past the
+# limit the spell asked about least recently is dropped.
+CASTABILITY_LIMIT = 64
+
 class Context:
     def __init__(self, caster, engine, target: Optional[(int, int)]):
         self.caster = caster
         self.engine = engine
         self.supplied_target = target
-        self.attributes = dict()
-        self.dry_run = False
         self.quiet = False
 
+def compile_plan(tokens, connections):
+    """Flatten a spell's token graph into a list of (token, input slots).
+
+    The steps are in evaluation order, ending with the sink, and each step's
+    inputs are the positions of earlier steps in the list.
+    """
+    sink = None
+    for (i, token) in enumerate(tokens):
+        if "sink" in token.outputs:
+            sink = i
+            break
+
+    slots = {}
+    plan = []
+    stack = [(sink, False)]
+    while stack:
+        (idx, ready) = stack.pop()
+        if idx in slots:
+            continue
+        if ready:
+            slots[idx] = len(plan)
+            plan.append((tokens[idx], tuple(slots[src] for src in connections[idx])))
+        else:
+            stack.append((idx, True))
+            for src in reversed(connections[idx]):
+                stack.append((src, False))
+    return plan
+
+def canonical_form(tokens, connections):
+    """Return a hashable form of a spell's token graph that doesn't depend on
+    the order its tokens happen to be listed in.
+
+    The graph is written out as nested (kind, inputs) tuples from the sink,
+    followed by the kinds of any tokens the sink never reaches, since those
+    are still paid for when casting.
+    """
+    forms = [None] * len(tokens)
+
+    def form(idx):
+        if forms[idx] is None:
+            forms[idx] = (tokens[idx].kind, tuple(form(src) for src in connections[idx]))
+        return forms[idx]
+
+    root = None
+    for (i, token) in enumerate(tokens):
+        if "sink" in token.outputs:
+            root = form(i)
+            break
+    loose = tuple(sorted(tokens[i].kind for i in range(len(tokens)) if forms[i] is None))
+    return (root, loose)
+
+# Every live spell by canonical form, so structurally identical spells are
+# one shared object.
+SPELLS = weakref.WeakValueDictionary()
+
+def intern_spell(tokens, connections):
+    """Return the shared Spell for this token graph, creating it if needed."""
+    spell = SPELLS.get(canonical_form(tokens, connections))
+    if spell is None:
+        spell = Spell(tokens, connections)
+        SPELLS[spell.key] = spell
+    return spell
+
 class Spell:
+    """A token graph and what is known about it without casting it.
+
+    Spells are never changed after construction, so copies share the
+    original and equal spells are interchangeable; build them with
+    `intern_spell` to share one object per graph.
+    """
     def __init__(self, tokens, connections):
-        self.tokens = tokens
-        self.connections  = connections
+        self.tokens = tuple(tokens)
+        self.connections = tuple(tuple(ids) for ids in connections)
+        self.key = canonical_form(self.tokens, self.connections)
+        self._hash = hash(self.key)
+        self._plan = None
+        self._token_counts = None
         self.attributes = self.calculate_attributes()
 
+    def __eq__(self, other):
+        return self is other or (isinstance(other, Spell) and self.key == other.key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # Loaded spells join the intern table instead of duplicating it.
+        return (intern_spell, (self.tokens, self.connections))
+
+    @property
+    def digest(self):
+        """A hash of the canonical form that is stable across sessions."""
+        return hashlib.sha1(repr(self.key).encode()).hexdigest()[:16]
+
+    @property
+    def plan(self):
+        """The compiled form of this spell, built on first use."""
+        if self._plan is None:
+            self._plan = compile_plan(self.tokens, self.connections)
+        return self._plan
+
     def __str__(self):
         return ", ".join([t.name for t in self.tokens])
 
+    @property
+    def token_counts(self):
+        """How many of each token this spell consumes, keyed by token id."""
+        if self._token_counts is None:
+            self._token_counts = Counter(t.token_id for t in self.tokens)
+        return self._token_counts
+
     def needs_target(self) -> bool:
         for token in self.tokens:
             if isinstance(token, SpecificTarget):
@@ -41,10 +154,16 @@ class Spell:
         return False
 
     def calculate_attributes(self):
-        context = Context(None, None, None)
-        context.dry_run = True
-        PreparedSpell(self).cast(context)
-        return context.attributes
+        """Fold every token's static contribution over the plan.
+
+        Nothing is cast, so this needs no Context and has no effects.
+        """
+        attributes = {}
+        plan = self.plan
+        values = [None] * len(plan)
+        for (i, (token, inputs)) in enumerate(plan):
+            values[i] = token.infer(attributes, *[values[j] for j in inputs])
+        return attributes
 
     def name(self):
         attributes = self.attributes
@@ -56,44 +175,21 @@ class Spell:
             return f"summon a {attributes['creature']}"
 
     def can_cast(self, inventory) -> bool:
-        return self.prepare_from_inventory(inventory, True) is not None
+        return inventory.has_tokens(self.token_counts)
 
     def max_casts(self, inventory):
-        needed = Counter(self.tokens);
-        min_count = 10000000
-        for (token, count) in needed.items():
-            found = False
-            for item in inventory.items:
-                if item.token == token:
-                    num = item.count / count
-                    if num < min_count:
-                        min_count = num
-                    found = True
-                    break
-            if not found:
-                 return 0
-        return min_count
+        return min(
+            inventory.token_count(token_id) // count
+            for (token_id, count) in self.token_counts.items()
+        )
 
     def prepare_from_inventory(self, inventory, dry_run = False) -> Optional[PreparedSpell]:
-        consumed = {}
-        for token in self.tokens:
-            found = False
-            for item in inventory.items:
-                if item.token == token and item.count-consumed.get(token, 0) > 0:
-                    consumed[token] = consumed.get(token, 0) + 1
-                    found = True
-                    break
-            if not found:
-                return None
-        if not dry_run:
-            removed = []
-            for item in inventory.items:
-                if item.token in consumed:
-                    item.count -= consumed[item.token]
-                    if item.count <= 0:
-                        removed.append(item)
-            for item in removed:
-                inventory.items.remove(item)
+        if dry_run:
+            ready = inventory.has_tokens(self.token_counts)
+        else:
+            ready = inventory.remove_tokens(self.token_counts)
+        if not ready:
+            return None
         return PreparedSpell(self)
 
 class PreparedSpell:
@@ -104,27 +200,10 @@ class PreparedSpell:
         return ", ".join([t.name for t in self.spell.tokens])
 
     def cast(self, context):
-        sink = None
-        for (i, token) in enumerate(self.spell.tokens):
-            for output in token.outputs:
-                if output == "sink":
-                    sink = i
-                    break
-            if sink is not None:
-                 break
-
-        self.cast_rec(context, sink, "sink")
-
-    def cast_rec(self, context, token_idx, src_type):
-         connections = self.spell.connections[token_idx]
-         inputs = []
-         for src_idx in connections:
-             inputs.append(self.cast_rec(context, src_idx, src_type))
-         try:
-             return self.spell.tokens[token_idx].process(context, *inputs)
-         except:
-             print(f"Failed to process token: {self.spell.tokens[token_idx]} with inputs {inputs}")
-             raise
+        plan = self.spell.plan
+        values = [None] * len(plan)
+        for (i, (token, inputs)) in enumerate(plan):
+            values[i] = token.process(context, *[values[j] for j in inputs])
 
 class Magic(BaseComponent):
     parent: Item
@@ -132,6 +211,58 @@ class Magic(BaseComponent):
     def __init__(self):
         self.known_tokens = set()
         self.spell_inventory = SpellInventory(self)
+        # How many times each spell asked about can be cast, kept up to date
+        # from the inventory's token changes rather than recounted.
+        self.castability = {}
+        self.spells_by_token = {}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # The spells are loaded with re-interned token ids, see
+        # Inventory.__setstate__, so index them again under those.
+        self.spells_by_token = {}
+        for spell in self.castability:
+            for token_id in spell.token_counts:
+                self.spells_by_token.setdefault(token_id, set()).add(spell)
+
+    def reset(self) -> None:
+        """Forget every spell and known token, as if newly made."""
+        self.known_tokens.clear()
+        self.spell_inventory.clear()
+        self.castability.clear()
+        self.spells_by_token.clear()
+
+    def max_casts(self, spell: Spell) -> int:
+        casts = self.castability.pop(spell, None)
+        if casts is None:
+            if len(self.castability) >= CASTABILITY_LIMIT:
+                self.forget_spell(next(iter(self.castability)))
+            casts = spell.max_casts(self.parent.inventory)
+            for token_id in spell.token_counts:
+                self.spells_by_token.setdefault(token_id, set()).add(spell)
+        # Reinserted so the table stays in least recently asked order.
+        self.castability[spell] = casts
+        return casts
+
+    def forget_spell(self, spell: Spell) -> None:
+        """Drop `spell` from the castability table."""
+        del self.castability[spell]
+        for token_id in spell.token_counts:
+            spells = self.spells_by_token[token_id]
+            spells.discard(spell)
+            if not spells:
+                del self.spells_by_token[token_id]
+
+    def can_cast(self, spell: Spell) -> bool:
+        return self.max_casts(spell) > 0
+
+    def tokens_changed(self, token_ids) -> None:
+        """Refresh the cast counts of the spells that use any of `token_ids`."""
+        affected = set()
+        for token_id in token_ids:
+            affected.update(self.spells_by_token.get(token_id, ()))
+        for spell in affected:
+            self.castability[spell] = spell.max_casts(self.parent.inventory)
 
     def fill_default_spell_slots(self):
         from spell_generator import SHARED_GRIMOIRE
@@ -167,7 +298,7 @@ class Magic(BaseComponent):
 
     def cast_bump_spell(self, target: Actor) -> Optional[ActionOrHandler]:
         if self.spell_inventory.bump_spell is not None:
-            if self.spell_inventory.bump_spell.can_cast(self.parent.inventory):
+            if self.can_cast(self.spell_inventory.bump_spell):
                 return self.cast_spell(self.spell_inventory.bump_spell, (target.x, target.y))
             elif self.spell_inventory.bump_spell_free:
                 return self.cast_spell(self.spell_inventory.bump_spell_free, (target.x, target.y), True)
@@ -176,16 +307,16 @@ class Magic(BaseComponent):
 
     def assure_castability(self, spell, times):
         if spell:
-            for (token, count) in Counter(spell.tokens).items():
-                for _ in range(times*count):
-                    self.parent.inventory.add_token(token)
+            self.parent.inventory.add_tokens(
+                (token, times*count) for (token, count) in Counter(spell.tokens).items()
+            )
 
     def remember_spell_tokens(self, spell):
         if spell:
-            self.known_tokens.update({t.__class__ for t in spell.tokens})
+            self.known_tokens.update(spell.tokens)
 
     def cast_spell(self, spell: Spell, target: Optional[Actor] = None, ignore_cost = False) -> Optional[ActionOrHandler]:
-        if not ignore_cost and not spell.can_cast(self.parent.inventory):
+        if not ignore_cost and not self.can_cast(spell):
             return None
         prepared_spell = None
         if not ignore_cost:
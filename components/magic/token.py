@@ -1,25 +1,77 @@
-from random import sample, shuffle, random, choice
-import math
+from random import sample, shuffle, random
 from inspect import signature
 from spell_visualization import AOECircle, BeamLine
+from area_effects import Area, actors_on_line, clip_line
 import entity_factories
 import tile_types
-from tcod.los import bresenham
+from tile_types import TileLabel
 
 import color
+from message_log import MessageEvent
 
 def all_tokens():
-    tokens_with_default_constructors = []
-    def class_and_descendents(c):
-        ds = [c]
-        for c in c.__subclasses__():
-            ds.extend(class_and_descendents(c))
-        return ds
-    for token in class_and_descendents(Token):
-        sig = signature(token)
-        if len(sig.parameters) == 0:
-            tokens_with_default_constructors.append(token)
-    return tokens_with_default_constructors
+    """Return every token class that can be built without arguments."""
+    return list(TOKEN_CLASSES)
+
+def token_instances():
+    """Return the shared instance of every default-constructible token.
+
+    Tokens are immutable, so these flyweights can be used anywhere a fresh
+    token would have been built.  The returned list is a copy.
+    """
+    return list(TOKENS)
+
+# Token ids are interned on the same (name, inputs, outputs) key tokens have
+# always been compared by, so e.g. every "emerald shard" is the same kind.
+TOKEN_IDS = {}
+
+def intern_token_id(name, inputs, outputs):
+    key = (name, frozenset(inputs), frozenset(outputs))
+    token_id = TOKEN_IDS.get(key)
+    if token_id is None:
+        token_id = len(TOKEN_IDS)
+        TOKEN_IDS[key] = token_id
+    return token_id
+
+
+MATERIAL_DAMAGE = {
+    "poop": 1,
+    "fire": 10,
+    "lightning": 10,
+    "screaming elemental void": 20,
+    "strong coffee": 1,
+    "knives": 5,
+    "ice": 5,
+    "wall": 0,
+}
+BEAM_MATERIAL_DAMAGE = dict(MATERIAL_DAMAGE, **{"gnawing teeth": 0.1})
+BALL_RADIUS = {"small": 1, "medium": 2, "large": 4, "stupendous": 12}
+BEAM_DAMAGE_MULTIPLIER = {"small": 1, "medium": 2, "large": 4, "stupendous": 10}
+HEAL_AMOUNT = {"small": 5, "medium": 10, "large": 20, "stupendous": 100}
+
+
+def log_spell_hit(context, actor, shape, scale, material, outcome):
+    """Record the outcome of a spell hitting `actor` in the message log."""
+    if context.quiet:
+        return
+    (kind, amount) = outcome
+    if kind == "heal" and actor is context.engine.player:
+        fg = color.health_recovered
+    else:
+        fg = color.white
+    context.engine.message_log.add_event(
+        MessageEvent(
+            "spell_hit",
+            actor.name,
+            target_id=actor.serial,
+            outcome=kind,
+            amount=amount,
+            damage_type=material,
+            scale=scale,
+            shape=shape,
+        ),
+        fg,
+    )
 
 
 class Token:
@@ -27,60 +79,89 @@ class Token:
         self.name = name
         self.inputs = inputs
         self.outputs = outputs
+        self.token_id = intern_token_id(name, inputs, outputs)
 
     def __eq__(self, other):
-        return self.name == other.name and set(self.inputs) == set(other.inputs) and set(self.outputs) == set(other.outputs)
+        return isinstance(other, Token) and self.token_id == other.token_id
 
     def __hash__(self):
-        return hash((self.name, tuple(set(self.inputs)), tuple(set(self.outputs))))
+        return self.token_id
+
+    @property
+    def kind(self):
+        """Like token_id, but tells apart tokens that share an id, such as
+        the range shards."""
+        return (type(self).__name__, self.token_id)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # Tokens never change after construction, so copies can share them.
+        return self
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Ids depend on the order tokens were first built in, so re-intern
+        # tokens coming from another session.
+        self.token_id = intern_token_id(self.name, self.inputs, self.outputs)
 
     def process(self, context, *args):
         assert(False)
 
+    def infer(self, attributes, *args):
+        """Add this token's contribution to a spell's static attributes.
+
+        `args` are the static values of the inputs, as returned by their own
+        `infer`, and the return value is the static value of this token.
+        Unlike `process` this needs no Context and has no effects.
+        """
+        return None
+
 class AllActors(Token):
     def __init__(self):
         super().__init__("grey shard", ["caster"], ["target"])
 
     def process(self, context):
-        if context.dry_run:
-            return []
-        else:
-            return [(o.x, o.y) for o in context.engine.game_map.actors if o != context.caster and context.engine.game_map.visible[o.x, o.y]]
+        return context.engine.visibility.visible_targets(context.caster)
 
 class TheCaster(Token):
     def __init__(self):
         super().__init__("black shard", ["caster"], ["target"])
 
     def process(self, context):
-        context.attributes["targets_caster"] = True
-        if context.dry_run:
-            return []
-        else:
-            return [(context.caster.x, context.caster.y)]
+        return [(context.caster.x, context.caster.y)]
+
+    def infer(self, attributes):
+        attributes["targets_caster"] = True
 
 class SpecificTarget(Token):
     def __init__(self):
         super().__init__("chalk shard", ["caster"], ["target"])
 
     def process(self, context):
-        context.attributes["requires_target"] = True
         if context.supplied_target:
             return [(context.supplied_target[0], context.supplied_target[1])]
         else:
             return []
 
+    def infer(self, attributes):
+        attributes["requires_target"] = True
+
 class WithinRange(Token):
     def __init__(self, range):
         super().__init__("emerald shard", ["target"], ["target"])
         self.range = range
 
     def process(self, context, targets):
-        context.attributes["range"] = min(context.attributes.get("range", 2**32), self.range)
         if targets:
             return [t for t in targets if context.caster.distance(*t) <= self.range]
         else:
             return []
 
+    def infer(self, attributes, targets):
+        attributes["range"] = min(attributes.get("range", 2**32), self.range)
+
 class ClosestTarget(Token):
     def __init__(self, range):
         super().__init__("jade shard", ["target"], ["target"])
@@ -109,7 +190,10 @@ class MadeOfWhatever(Token):
         super().__init__(name, [], ["material"])
 
     def process(self, context):
-        context.attributes["material"] = self.material
+        return self.material
+
+    def infer(self, attributes):
+        attributes["material"] = self.material
         return self.material
 
 #class DoubleMaterial(Token):
@@ -126,6 +210,9 @@ class Small(Token):
     def process(self, context):
         return "small"
 
+    def infer(self, attributes):
+        return "small"
+
 class Medium(Token):
     def __init__(self):
         super().__init__("singing module", [], ["scale"])
@@ -133,6 +220,9 @@ class Medium(Token):
     def process(self, context):
         return "medium"
 
+    def infer(self, attributes):
+        return "medium"
+
 class Large(Token):
     def __init__(self):
         super().__init__("pooping module", [], ["scale"])
@@ -140,6 +230,9 @@ class Large(Token):
     def process(self, context):
         return "large"
 
+    def infer(self, attributes):
+        return "large"
+
 class Stupendous(Token):
     def __init__(self):
         super().__init__("dancing module", [], ["scale"])
@@ -147,227 +240,171 @@ class Stupendous(Token):
     def process(self, context):
         return "stupendous"
 
+    def infer(self, attributes):
+        return "stupendous"
+
 class BallOf(Token):
     def __init__(self):
         super().__init__("silver rod", ["material", "scale", "target"], ["sink"])
 
     def process(self, context, material, scale, targets):
-        damage = 0
-        if material == "poop":
-            damage = 1
-        elif material == "fire":
-            damage = 10
-        elif material == "lightning":
-            damage = 10
-        elif material == "screaming elemental void":
-            damage = 20
-        elif material == "strong coffee":
-            damage = 1
-        elif material == "knives":
-            damage = 5
-        elif material == "ice":
-            damage = 5
-        elif material == "wall":
-            damage = 0
-        radius = 0
-        if scale == "small":
-            radius = 1
-        elif scale == "medium":
-            radius = 2
-        elif scale == "large":
-            radius = 4
-        elif scale == "stupendous":
-            radius = 12
-        context.attributes["base_damage"] = damage
-        context.attributes["AOE_radius"] = radius
-        context.attributes["spell_shape"] = "ball"
-
-        if context.dry_run:
-            return
+        damage = MATERIAL_DAMAGE.get(material, 0)
+        radius = BALL_RADIUS.get(scale, 0)
 
         if targets:
             for target in targets:
                 context.engine.spell_overlay.push_effect(AOECircle(target, radius, (255, 0, 0)))
-                for dx in range(-radius, radius+1):
-                    for dy in range(-radius, radius+1):
-                        if math.sqrt(dx*dx+dy*dy) <= radius:
-                            actor = context.engine.game_map.get_actor_at_location(target[0]+dx, target[1]+dy)
-                            if material == "screaming elemental void":
-                                x = target[0]+dx
-                                y = target[1]+dy
-                                if context.engine.game_map.tiles[x, y] == tile_types.wall:
-                                    context.engine.game_map.tiles[x, y] = tile_types.floor
-                            if material == "wall" and actor is None:
-                                context.engine.game_map.tiles[target[0]+dx, target[1]+dy] = tile_types.wall
-                            elif material != "wall":
-                                if actor:
-                                    if not context.quiet:
-                                        outcome_message = f"A {scale} ball of {material} hits {actor.name} and "
-                                        outcome_message += actor.fighter.damage(damage, material)
-                                        if "Player" in outcome_message and "heals" in outcome_message:
-                                            context.engine.message_log.add_message(outcome_message, color.health_recovered)
-                                        else:
-                                            context.engine.message_log.add_message(outcome_message)
+                area = Area(context.engine.game_map, target, radius)
+                if material == "screaming elemental void":
+                    area.carve_walls()
+                if material == "wall":
+                    area.build(tile_types.wall)
+                else:
+                    for actor in area.actors():
+                        if actor.is_alive:
+                            outcome = actor.fighter.damage(damage, material)
+                            log_spell_hit(context, actor, "ball", scale, material, outcome)
         elif not context.quiet:
             context.engine.message_log.add_message("nothing happens")
 
+    def infer(self, attributes, material, scale, targets):
+        attributes["base_damage"] = MATERIAL_DAMAGE.get(material, 0)
+        attributes["AOE_radius"] = BALL_RADIUS.get(scale, 0)
+        attributes["spell_shape"] = "ball"
+
 class BeamOf(Token):
+    piercing = False
+
     def __init__(self):
         super().__init__("copper rod", ["material", "scale", "target"], ["sink"])
 
     def process(self, context, material, scale, targets):
-        damage = 0
-        if material == "poop":
-            damage = 1
-        elif material == "fire":
-            damage = 10
-        elif material == "lightning":
-            damage = 10
-        elif material == "screaming elemental void":
-            damage = 20
-        elif material == "strong coffee":
-            damage = 1
-        elif material == "knives":
-            damage = 5
-        elif material == "ice":
-            damage = 5
-        elif material == "gnawing teeth":
-            damage = 0.1
-        elif material == "wall":
-            damage = 0
-        if scale == "small":
-            damage *= 1
-        elif scale == "medium":
-            damage *= 2
-        elif scale == "large":
-            damage *= 4
-        elif scale == "stupendous":
-            damage *= 10
-        context.attributes["base_damage"] = damage
-        context.attributes["AOE_radius"] = 0
-        context.attributes["spell_shape"] = "beam"
-
-        if context.dry_run:
-            return
+        damage = BEAM_MATERIAL_DAMAGE.get(material, 0) * BEAM_DAMAGE_MULTIPLIER.get(scale, 1)
 
         if targets:
+            game_map = context.engine.game_map
+            source = (context.caster.x, context.caster.y)
             for target in targets:
-                actor = context.engine.game_map.get_actor_at_location(target[0], target[1])
+                (xs, ys) = clip_line(game_map, *context.engine.traces.trace(source, target))
                 if material == "screaming elemental void":
-                    for (tx, ty) in bresenham((context.caster.x, context.caster.y), target):
-                        if context.engine.game_map.tiles[tx, ty] == tile_types.wall:
-                            context.engine.game_map.tiles[tx, ty] = tile_types.floor
-                if actor is None and material == "wall":
-                    for (tx, ty) in bresenham((context.caster.x, context.caster.y), target):
-                        context.engine.game_map.tiles[tx, ty] = tile_types.wall
-                elif actor is not None and material != "wall":
-                    context.engine.spell_overlay.push_effect(BeamLine((context.caster.x, context.caster.y), target, (0, 0, 255)))
-                    if not context.quiet:
-                        outcome_message = f"A {scale} beam of {material} hits {actor.name} and "
-                        outcome_message += actor.fighter.damage(damage, material)
-                        if "Player" in outcome_message and "heals" in outcome_message:
-                            context.engine.message_log.add_message(outcome_message, color.health_recovered)
-                        else:
-                            context.engine.message_log.add_message(outcome_message)
+                    walls = game_map.tiles["label"][xs, ys] == TileLabel.Wall
+                    if walls.any():
+                        game_map.tiles[xs[walls], ys[walls]] = tile_types.floor
+                        game_map.terrain_changed()
+                if self.piercing:
+                    actors = [a for a in actors_on_line(game_map, xs, ys) if a is not context.caster]
+                else:
+                    actor = game_map.get_actor_at_location(target[0], target[1])
+                    actors = [actor] if actor is not None else []
+                if not actors and material == "wall":
+                    game_map.tiles[xs, ys] = tile_types.wall
+                    game_map.terrain_changed()
+                elif actors and material != "wall":
+                    context.engine.spell_overlay.push_effect(BeamLine(source, target, (0, 0, 255)))
+                    for actor in actors:
+                        outcome = actor.fighter.damage(damage, material)
+                        log_spell_hit(context, actor, self.shape, scale, material, outcome)
                 elif not context.quiet:
-                    context.engine.message_log.add_message(f"A {scale} beam of {material} hits the ground, acomplishing nothing")
+                    context.engine.message_log.add_message(f"A {scale} {self.shape} of {material} hits the ground, acomplishing nothing")
         elif not context.quiet:
             context.engine.message_log.add_message("nothing happens")
 
+    @property
+    def shape(self):
+        return "piercing beam" if self.piercing else "beam"
+
+    def infer(self, attributes, material, scale, targets):
+        attributes["base_damage"] = BEAM_MATERIAL_DAMAGE.get(material, 0) * BEAM_DAMAGE_MULTIPLIER.get(scale, 1)
+        attributes["AOE_radius"] = 0
+        attributes["spell_shape"] = self.shape
+        if self.piercing:
+            attributes["piercing"] = True
+
+class PiercingBeamOf(BeamOf):
+    """A beam that hits every actor between the caster and the target.
+
+    Optional, see OPTIONAL_TOKEN_CLASSES.
+    """
+    piercing = True
+    optional = True
+
+    def __init__(self):
+        Token.__init__(self, "gold rod", ["material", "scale", "target"], ["sink"])
+
 class Heal(Token):
     def __init__(self):
         super().__init__("churlish rat", ["scale", "target"], ["sink"])
 
     def process(self, context, scale, targets):
-        heal = 0
-        if scale == "small":
-            heal = 5
-        elif scale == "medium":
-            heal = 10
-        elif scale == "large":
-            heal = 20
-        elif scale == "stupendous":
-            heal = 100
-        context.attributes["base_damage"] = -heal
-        context.attributes["is_heal"] = True
-
-        if context.dry_run:
-            return
+        heal = HEAL_AMOUNT.get(scale, 0)
 
         if targets:
             for target in targets:
-                actor = context.engine.game_map.get_actor_at_location(target[0], target[1])
-                if actor is not None:
+                actors = Area(context.engine.game_map, target, 0).actors()
+                if actors:
                     context.engine.spell_overlay.push_effect(AOECircle(target, 2, (0, 255, 0)))
+                for actor in actors:
+                    healed = actor.fighter.increase_hp(heal)
                     if not context.quiet:
-                        context.engine.message_log.add_message(
-                            f"{actor.name} heals for {actor.fighter.increase_hp(heal)}!",
+                        context.engine.message_log.add_event(
+                            MessageEvent("heal", actor.name, target_id=actor.serial, amount=healed),
                             color.health_recovered
                         )
-                elif not context.quiet:
+                if not actors and not context.quiet:
                     context.engine.message_log.add_message(f"nothing happens")
         elif not context.quiet:
             context.engine.message_log.add_message("nothing happens")
 
+    def infer(self, attributes, scale, targets):
+        attributes["base_damage"] = -HEAL_AMOUNT.get(scale, 0)
+        attributes["is_heal"] = True
+
 class Summon(Token):
     def __init__(self):
         super().__init__("obsidian jug", ["creature", "target"], ["sink"])
 
     def process(self, context, creature, targets):
-        context.attributes["is_summon"] = True
-
-        if context.dry_run:
-            return
-
         if targets:
+            placement = context.engine.game_map.placement
             for target in targets:
-                count = 0
-                for c in creature[1]():
-                    drop_targets = []
-                    for dx in range(-1, 2):
-                        for dy in range(-1, 2):
-                            x = target[0] + dx
-                            y = target[1] + dy
-                            if x >= 0 and x < context.engine.game_map.width and y >= 0 and y < context.engine.game_map.height and context.engine.game_map.tiles["walkable"][x,y]:
-                                if not context.engine.game_map.get_blocking_entity_at_location(x,y):
-                                    drop_targets.append((x,y))
-                    if drop_targets:
-                        target = choice(drop_targets)
-                        context.engine.spell_overlay.push_effect(AOECircle(target, 2, (0, 0, 255)))
-                        c.spawn(context.engine.game_map, target[0], target[1])
-                        count += 1
-                if count > 0:
+                spawned = placement.place(creature[1](), target[0], target[1])
+                for c in spawned:
+                    context.engine.spell_overlay.push_effect(AOECircle((c.x, c.y), 2, (0, 0, 255)))
+                if spawned:
                     if not context.quiet:
-                        if count > 1:
-                            context.engine.message_log.add_message(
-                                f"{count} {creature[0]}s appear",
-                                color.player_atk
-                            )
-                        else:
-                            context.engine.message_log.add_message(
-                                f"a {creature[0]} appears",
-                                color.player_atk
-                            )
-                    elif not context.quiet:
-                        context.engine.message_log.add_message(f"nothing happens")
+                        context.engine.message_log.add_event(
+                            MessageEvent("summon", creature[0], amount=len(spawned)),
+                            color.player_atk
+                        )
                 elif not context.quiet:
                     context.engine.message_log.add_message("nothing happens")
         elif not context.quiet:
             context.engine.message_log.add_message("nothing happens")
 
+    def infer(self, attributes, creature, targets):
+        attributes["is_summon"] = True
+
 class Creature(Token):
-    def __init__(self, name, creature_name, creature_fn):
+    def __init__(self, name, creature_name, factory_name):
         super().__init__(name, [], ["creature"])
         self.creature_name = creature_name
-        self.creature_fn = creature_fn
+        self.factory_name = factory_name
+
+    @property
+    def creature_fn(self):
+        # Looked up when summoning, since the factories can be swapped out.
+        return getattr(entity_factories, self.factory_name)
 
     def process(self, context):
-        context.attributes["creature"] = self.creature_name
+        return (self.creature_name, self.creature_fn)
+
+    def infer(self, attributes):
+        attributes["creature"] = self.creature_name
         return (self.creature_name, self.creature_fn)
 
 class Squirrel(Creature):
     def __init__(self):
-        super().__init__("flint needle", "squirrel", entity_factories.squirrel)
+        super().__init__("flint needle", "squirrel", "squirrel")
 
 class MeleeRange(WithinRange):
     def __init__(self):
@@ -404,3 +441,24 @@ class MadeOfScreamingElementalVoid(MadeOfWhatever):
 class MadeOfWall(MadeOfWhatever):
     def __init__(self):
         super().__init__("dusty globule", "wall")
+
+
+def _default_token_classes():
+    def class_and_descendents(c):
+        ds = [c]
+        for c in c.__subclasses__():
+            ds.extend(class_and_descendents(c))
+        return ds
+    return [
+        token for token in class_and_descendents(Token)
+        if len(signature(token).parameters) == 0
+        and (not getattr(token, "optional", False) or token in OPTIONAL_TOKEN_CLASSES)
+    ]
+
+# Token kinds marked `optional` only join the default set when listed here.
+# A new kind in the default set changes which tokens monsters are granted
+# and which spells grimoires hold, and shifts the ids of later kinds.
+OPTIONAL_TOKEN_CLASSES = ()
+
+TOKEN_CLASSES = _default_token_classes()
+TOKENS = [token() for token in TOKEN_CLASSES]
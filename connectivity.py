@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class CellGraph:
+    """The free cells of a (width, height) mask, each joined to its 8 neighbors.
+
+    Cells are numbered in a copy of the mask padded with a blocked border,
+    so neighbors are fixed offsets with no bounds checks. Movement is 8-way
+    like the SimpleGraph the monsters path on.
+    """
+
+    def __init__(self, free: np.ndarray):
+        (width, height) = free.shape
+        self.stride = height + 2
+        padded = np.zeros((width + 2, height + 2), dtype=bool)
+        padded[1:-1, 1:-1] = free
+        self.free = padded.ravel().tolist()
+        s = self.stride
+        self.offsets = (-s - 1, -s, -s + 1, -1, 1, s - 1, s, s + 1)
+
+    def index(self, x: int, y: int) -> int:
+        return (x + 1) * self.stride + y + 1
+
+    def cell(self, i: int) -> Tuple[int, int]:
+        (x, y) = divmod(i, self.stride)
+        return (x - 1, y - 1)
+
+    def neighbors(self, i: int):
+        free = self.free
+        return [i + d for d in self.offsets if free[i + d]]
+
+    def shortest_path(self, start: int, end: int) -> Optional[List[int]]:
+        """Return the cells of a shortest path from start to end, or None."""
+        free = self.free
+        offsets = self.offsets
+        parent = [-1] * len(free)
+        parent[start] = start
+        queue = deque((start,))
+        while queue:
+            i = queue.popleft()
+            if i == end:
+                path = [i]
+                while i != start:
+                    i = parent[i]
+                    path.append(i)
+                path.reverse()
+                return path
+            for d in offsets:
+                j = i + d
+                if free[j] and parent[j] < 0:
+                    parent[j] = i
+                    queue.append(j)
+        return None
+
+    def articulations(self, start: int, end: int) -> List[int]:
+        """Return the single cells whose removal cuts `end` off from `start`.
+
+        This is Tarjan's articulation point search from `start`, keeping
+        only the cut vertices that have `end` below them in the DFS tree.
+        """
+        free = self.free
+        offsets = self.offsets
+        order = [0] * len(free)
+        low = [0] * len(free)
+        order[start] = low[start] = count = 1
+        found = []
+        stack = [start]
+        # How many of its neighbors each cell on the stack has looked at.
+        looked = [0]
+        while stack:
+            v = stack[-1]
+            k = looked[-1]
+            while k < 8:
+                c = v + offsets[k]
+                k += 1
+                if free[c]:
+                    if not order[c]:
+                        break
+                    if order[c] < low[v]:
+                        low[v] = order[c]
+            else:
+                stack.pop()
+                looked.pop()
+                if not stack:
+                    break
+                u = stack[-1]
+                if low[v] < low[u]:
+                    low[u] = low[v]
+                # Everything numbered since v was reached is below v, so
+                # that is where `end` is if its number is at least v's.
+                if u != start and low[v] >= order[u] and order[end] >= order[v]:
+                    found.append(u)
+                continue
+            looked[-1] = k
+            count += 1
+            order[c] = low[c] = count
+            stack.append(c)
+            looked.append(0)
+        return found
+
+    def min_vertex_cut(self, start: int, end: int) -> List[int]:
+        """Return a smallest set of cells cutting `end` off from `start`.
+
+        Max-flow with every cell split into an entry and an exit joined by
+        one unit of capacity, so the augmenting paths found are vertex
+        disjoint. Each search is a BFS over the residual graph.
+        """
+        free = self.free
+        offsets = self.offsets
+        # through[i]: cell i carries a unit of flow. pred[i]: the cell that
+        # unit came from, one at most since each cell carries one unit.
+        through = [False] * len(free)
+        pred = {}
+
+        def residual_search():
+            # A state is 2 * cell + exited: a path in state 2 * i has entered
+            # cell i but not yet used its unit of capacity.
+            seen = [-1] * (2 * len(free))
+            seen[2 * start + 1] = 2 * start + 1
+            queue = deque((2 * start + 1,))
+            while queue:
+                state = queue.popleft()
+                i = state >> 1
+                if i == end:
+                    return (seen, state)
+                if state & 1:
+                    # Into any neighbor, or back against i's own unit.
+                    moves = [2 * (i + d) for d in offsets if free[i + d]]
+                    if through[i]:
+                        moves.append(2 * i)
+                else:
+                    moves = []
+                    if not through[i] or i == start:
+                        moves.append(2 * i + 1)
+                    if i in pred:
+                        moves.append(2 * pred[i] + 1)
+                for move in moves:
+                    if seen[move] < 0:
+                        seen[move] = state
+                        queue.append(move)
+            return (seen, None)
+
+        while True:
+            (seen, state) = residual_search()
+            if state is None:
+                break
+            # Walk the path back from `end`, updating flow on the way.
+            while state != 2 * start + 1:
+                previous = seen[state]
+                (i, j) = (state >> 1, previous >> 1)
+                if i == j:
+                    through[i] = bool(state & 1)
+                elif previous & 1:
+                    pred[i] = j
+                elif pred.get(j) == i:
+                    del pred[j]
+                state = previous
+
+        # The cut is every cell the last search could enter but not leave.
+        return [
+            i for i in range(len(free))
+            if seen[2 * i] >= 0 and seen[2 * i + 1] < 0 and i not in (start, end)
+        ]
+
+
+def chokepoints(free: np.ndarray, start: Tuple[int, int], end: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """Return a smallest set of free cells separating `start` from `end`.
+
+    A single cell is preferred, the one closest to the middle of a shortest
+    path between them; the general minimum cut is only searched for when
+    there is none. Returns [] if the two are already apart, or can't be
+    separated because they are neighbors.
+    """
+    free = free.copy()
+    free[start] = True
+    free[end] = True
+    graph = CellGraph(free)
+    (s, t) = (graph.index(*start), graph.index(*end))
+    path = graph.shortest_path(s, t)
+    if path is None or len(path) <= 2:
+        return []
+
+    cuts = graph.articulations(s, t)
+    if cuts:
+        step = {cell: n for (n, cell) in enumerate(path)}
+        middle = len(path) / 2
+        best = min(cuts, key=lambda cell: abs(step[cell] - middle))
+        return [graph.cell(best)]
+    return [graph.cell(i) for i in graph.min_vertex_cut(s, t)]
+
+
+def label_regions(free: np.ndarray) -> Tuple[np.ndarray, int]:
+    """Label the 8-connected regions of `free`, returning (labels, count).
+
+    Labels run from 1 to count, with 0 for blocked cells. This is a union
+    find done on whole arrays: every round each edge hooks the larger of
+    its two roots under the smaller, then pointer jumping flattens the
+    trees, until no edge joins two different roots.
+    """
+    (width, height) = free.shape
+    stride = height + 2
+    padded = np.zeros((width + 2, height + 2), dtype=bool)
+    padded[1:-1, 1:-1] = free
+    flat = padded.ravel()
+    cells = np.flatnonzero(flat)
+
+    # Each edge once, from a cell to its neighbors further along in memory.
+    heads = []
+    tails = []
+    for d in (1, stride - 1, stride, stride + 1):
+        linked = cells[flat[cells + d]]
+        heads.append(linked)
+        tails.append(linked + d)
+    heads = np.concatenate(heads)
+    tails = np.concatenate(tails)
+
+    parent = np.arange(flat.size)
+    while True:
+        a = parent[heads]
+        b = parent[tails]
+        apart = a != b
+        if not apart.any():
+            break
+        np.minimum.at(parent, np.maximum(a, b)[apart], np.minimum(a, b)[apart])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+    (roots, compact) = np.unique(parent[cells], return_inverse=True)
+    labels = np.zeros(flat.size, dtype=np.int32)
+    labels[cells] = compact + 1
+    return (labels.reshape(padded.shape)[1:-1, 1:-1], len(roots))
+
+
+class Regions:
+    """The walkable regions of a map, labelled again only once its terrain
+    changes.
+
+    Walkable tiles that touch, diagonals included, share a region, the
+    same way the monsters move. Entities are ignored since they can be
+    fought or waited out, and walls can't.
+    """
+
+    def __init__(self, game_map):
+        self.game_map = game_map
+        self.version = None
+        self._labels = None
+        self._count = 0
+
+    @property
+    def labels(self) -> np.ndarray:
+        if self.version != self.game_map.terrain_version:
+            (self._labels, self._count) = label_regions(self.game_map.tiles["walkable"])
+            self.version = self.game_map.terrain_version
+        return self._labels
+
+    def assume(self, labels: np.ndarray, count: int) -> None:
+        """Take `labels` as the regions of the map's current terrain, for a
+        generator that has labelled them already."""
+        (self._labels, self._count) = (labels, count)
+        self.version = self.game_map.terrain_version
+
+    @property
+    def count(self) -> int:
+        """The number of regions."""
+        self.labels
+        return self._count
+
+    def region_at(self, x: int, y: int) -> int:
+        """Return the region of (x, y), or 0 if it isn't walkable."""
+        if not self.game_map.in_bounds(x, y):
+            return 0
+        return int(self.labels[x, y])
+
+    def connected(self, a: Tuple[int, int], b: Tuple[int, int]) -> bool:
+        """Return True if one can walk from a to b."""
+        region = self.region_at(*a)
+        return region != 0 and region == self.region_at(*b)
+
+    def mask(self, region: int) -> np.ndarray:
+        """Return the cells of `region` as a boolean array."""
+        return self.labels == region
+
+    def sizes(self) -> np.ndarray:
+        """Return the number of cells in each region, indexed by label."""
+        return np.bincount(self.labels.ravel(), minlength=self._count + 1)
+
+    def largest(self) -> int:
+        """Return the label of the biggest region, or 0 if there is none."""
+        sizes = self.sizes()
+        sizes[0] = 0
+        return int(sizes.argmax())
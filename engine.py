@@ -8,13 +8,16 @@ from typing import TYPE_CHECKING
 from tcod.console import Console
 from tcod.map import compute_fov
 
+import color
 import exceptions
-from message_log import MessageLog
+from message_log import MessageEvent, MessageLog
 import render_functions
 from tile_types import TileLabel
 
 from pathing import PathingCache
 from spell_visualization import SpellVisualizationOverlay
+from visibility import VisibilityCache
+from area_effects import LineTraces
 
 from entity import Actor
 from game_map import GameMap, GameWorld
@@ -30,9 +33,13 @@ class Engine:
         self.player = player
         self.familiar = familiar
         self.pathing = PathingCache(self)
+        self.visibility = VisibilityCache(self)
+        self.traces = LineTraces(self)
         self.spell_overlay = SpellVisualizationOverlay(self)
         self.player_failed = None
         self.persisted_levels = {}
+        # Turns the player has taken, for caches that last one turn.
+        self.turn = 0
 
     def change_level(self, delta):
         if self.game_world.current_floor > 0:
@@ -51,6 +58,7 @@ class Engine:
             self.update_fov()
 
     def check_environment_interactions(self) -> None:
+        self.game_map.colony.materialize_mask(self.game_map.tiles["damage"] > 0)
         for actor in set(self.game_map.actors):
             damage = self.game_map.tiles["damage"][actor.x, actor.y]
             if damage:
@@ -59,9 +67,16 @@ class Engine:
                     message_color = color.player_dmg
                 else:
                     message_color = color.enemy_dmg
-                outcome_text = actor.fighter.damage(damage, env_hazard)
-                self.message_log.add_message(
-                    f"{actor.name} is standing in {env_hazard} which {outcome_text}.",
+                (outcome, amount) = actor.fighter.damage(damage, env_hazard)
+                self.message_log.add_event(
+                    MessageEvent(
+                        "environment",
+                        actor.name,
+                        target_id=actor.serial,
+                        outcome=outcome,
+                        amount=amount,
+                        damage_type=env_hazard,
+                    ),
                     message_color
                 )
 
@@ -90,8 +105,9 @@ class Engine:
         sq.magic.assure_castability(sq.magic.spell_inventory.ranged_spell, 10)
         sq.magic.assure_castability(sq.magic.spell_inventory.bump_spell, 10)
         sq.magic.assure_castability(sq.magic.spell_inventory.heal_spell, 10)
+        template = sq
         def squirrel_cultist():
-            return[sq]
+            return [copy.deepcopy(template)]
         entity_factories.squirrel = squirrel_cultist
         to_remove = set()
         to_add = set()
@@ -124,16 +140,36 @@ class Engine:
                     entity.ai.perform()
                 except exceptions.Impossible:
                     pass  # Ignore impossible action exceptions from AI.
-
-    def update_fov(self) -> None:
-        """Recompute the visible area based on the players point of view."""
-        self.game_map.visible[:] = compute_fov(
-            self.game_map.tiles["transparent"],
-            (self.player.x, self.player.y),
-            radius=8,
+        self.game_map.colony.grow()
+
+    def update_fov(self, radius: int = 8) -> None:
+        """Recompute the visible area based on the players point of view.
+
+        Nothing is recomputed unless the player moved or the terrain changed
+        since the last call for this map.
+        """
+        game_map = self.game_map
+        key = (self.player.x, self.player.y, radius, game_map.terrain_version)
+        if game_map.fov_key == key:
+            return
+        game_map.fov_key = key
+
+        # Nothing outside the radius can be seen, so only compute the FOV over
+        # the bounding box around the player.
+        x1 = max(0, self.player.x - radius)
+        y1 = max(0, self.player.y - radius)
+        x2 = min(game_map.width, self.player.x + radius + 1)
+        y2 = min(game_map.height, self.player.y + radius + 1)
+        window = (slice(x1, x2), slice(y1, y2))
+
+        game_map.visible[:] = False
+        game_map.visible[window] = compute_fov(
+            game_map.tiles["transparent"][window],
+            (self.player.x - x1, self.player.y - y1),
+            radius=radius,
         )
         # If a tile is "visible" it should be added to "explored".
-        self.game_map.explored |= self.game_map.visible
+        game_map.explored[window] |= game_map.visible[window]
 
     def render(self, console: Console) -> None:
         self.game_map.render(console)
@@ -18,6 +18,15 @@ if TYPE_CHECKING:
 
 T = TypeVar("T", bound="Entity")
 
+# The serial handed out last. Unlike id(), a serial is never reused by a
+# later entity, even once pooled entities are recycled.
+LAST_SERIAL = 0
+
+def new_serial() -> int:
+    global LAST_SERIAL
+    LAST_SERIAL += 1
+    return LAST_SERIAL
+
 
 class Entity:
     """
@@ -37,6 +46,7 @@ class Entity:
         blocks_movement: bool = False,
         render_order: RenderOrder = RenderOrder.CORPSE,
     ):
+        self.serial = new_serial()
         self.x = x
         self.y = y
         self.char = char
@@ -49,13 +59,34 @@ class Entity:
             self.parent = parent
             parent.entities.add(self)
 
+    def __deepcopy__(self, memo):
+        # A copy is a new entity, so it gets a serial of its own.
+        clone = self.__class__.__new__(self.__class__)
+        memo[id(self)] = clone
+        for (key, value) in self.__dict__.items():
+            setattr(clone, key, copy.deepcopy(value, memo))
+        clone.serial = new_serial()
+        return clone
+
+    def __setstate__(self, state):
+        global LAST_SERIAL
+        self.__dict__.update(state)
+        if "serial" not in state:
+            self.serial = new_serial()
+        LAST_SERIAL = max(LAST_SERIAL, self.serial)
+
     @property
     def gamemap(self) -> GameMap:
         return self.parent.gamemap
 
     def spawn(self: T, gamemap: GameMap, x: int, y: int) -> T:
         """Spawn a copy of this instance at the given location."""
-        clone = copy.deepcopy(self)
+        # The clone is given a new parent below, so the old one (for the
+        # familiar, a whole previous floor) is left out of the copy.
+        memo = {}
+        if hasattr(self, "parent"):
+            memo[id(self.parent)] = None
+        clone = copy.deepcopy(self, memo)
         clone.x = x
         clone.y = y
         clone.parent = gamemap
@@ -72,6 +103,8 @@ class Entity:
                     self.gamemap.entities.remove(self)
             self.parent = gamemap
             gamemap.entities.add(self)
+        elif hasattr(self, "parent"):
+            self.gamemap.placement.update(self)
 
     def distance(self, x: int, y: int) -> float:
         """
@@ -83,6 +116,7 @@ class Entity:
         # Move the entity by a given amount
         self.x += dx
         self.y += dy
+        self.gamemap.placement.update(self)
 
 
 class Actor(Entity):
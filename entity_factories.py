@@ -6,9 +6,12 @@ from components.inventory import Inventory
 from components.level import Level
 from components.magic import Magic
 from components.magic.token import *
-from entity import Actor, Item
-from spell_generator import random_spell_with_constraints, SHARED_GRIMOIRE
+from entity import Actor, Item, new_serial
+from spell_generator import SpellConstraints, SHARED_GRIMOIRE
+from spell_space import spell_space
+from functools import partial
 from random import gammavariate, random
+from render_order import RenderOrder
 
 player = Actor(
     char="@",
@@ -55,45 +58,185 @@ def orc():
   return [o]
 
 
+class Pool:
+    """Released entities of one archetype, handed out again before new ones
+    are built.
+
+    `build()` makes a blank entity and `reset(entity, *args)` gives a new or
+    released one the fields of a fresh one, so a recycled entity costs a few
+    attribute writes instead of a factory call and a deepcopy.
+    """
+
+    def __init__(self, name, build, reset, limit=256):
+        self.name = name
+        self.build = build
+        self.reset = reset
+        self.limit = limit
+        self.free = []
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+        POOLS[name] = self
+
+    def acquire(self, *args):
+        if self.free:
+            entity = self.free.pop()
+            self.reused += 1
+        else:
+            entity = self.build()
+            self.created += 1
+        self.reset(entity, *args)
+        # A recycled entity is a new one as far as anything else can tell.
+        entity.serial = new_serial()
+        entity.pool_name = self.name
+        return entity
+
+    def release(self, entity):
+        # Cleared so that releasing the same entity twice does nothing.
+        entity.pool_name = None
+        if hasattr(entity, "parent"):
+            del entity.parent
+        self.released += 1
+        if len(self.free) < self.limit:
+            self.free.append(entity)
+
+    def stats(self):
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "released": self.released,
+            "free": len(self.free),
+        }
+
+
+POOLS = {}
+
+def release(entity):
+    """Hand a dead actor or a discarded item back to its pool, if it has one."""
+    pool = POOLS.get(getattr(entity, "pool_name", None))
+    if pool is not None:
+        pool.release(entity)
+
+def pool_stats():
+    """Return {pool name: counters} for every pool, for profiling."""
+    return {name: pool.stats() for (name, pool) in POOLS.items()}
+
+def blank_actor():
+    return Actor(
+        ai_cls=DummyAI,
+        equipment=Equipment(),
+        fighter=Fighter(hp=1, base_defense=0, base_power=0),
+        inventory=Inventory(),
+        magic=Magic(),
+        level=Level(),
+    )
+
+def revive(actor, *, char, color, name, ai_cls, hp, base_defense, base_power, xp_given, dmg_multipliers=None):
+    """Give `actor` the fields Actor(...) and its components would start with."""
+    actor.char = char
+    actor.color = color
+    actor.name = name
+    actor.blocks_movement = True
+    actor.render_order = RenderOrder.ACTOR
+    actor.fighter.max_hp = hp
+    actor.fighter.hp = hp
+    actor.fighter.base_defense = base_defense
+    actor.fighter.base_power = base_power
+    actor.fighter.dmg_multipliers = dict(dmg_multipliers) if dmg_multipliers else {}
+    actor.level.xp_given = xp_given
+    actor.inventory.clear()
+    actor.magic.reset()
+    actor.ai = ai_cls(actor)
+
+def blank_item():
+    return Item()
+
+def reset_item(item, *, char, color=(255, 255, 255), name, x=0, y=0, count=1, token=None, spell=None):
+    item.x = x
+    item.y = y
+    item.char = char
+    item.color = color
+    item.name = name
+    item.count = count
+    item.token = token
+    item.spell = spell
+
+def reset_token_item(item, token):
+    reset_item(item, char=".", name=token.name, count=0, token=token)
+
+def reset_spell_item(item, x, y, spell):
+    reset_item(item, char="~", color=(255, 0, 255), name="spell", x=x, y=y, spell=spell)
+
+TOKEN_ITEMS = Pool("token item", blank_item, reset_token_item)
+SPELL_ITEMS = Pool("spell item", blank_item, reset_spell_item)
+
+def token_item(token):
+    """An empty inventory stack for `token`."""
+    return TOKEN_ITEMS.acquire(token)
+
+def spell_item(x, y, spell):
+    """A dropped spell lying at (x, y)."""
+    return SPELL_ITEMS.acquire(x, y, spell)
+
+
 def individual_mushroom(woody_chance=0.1):
     if random() < woody_chance:
-        return Actor(
+        return mushroom_actor(True, woody_chance+0.1)
+    else:
+        return mushroom_actor(False, woody_chance-0.05)
+
+def reset_mushroom(actor, woody, spawn_woody_chance):
+    # A partial rather than a lambda, so mushroom_traits can read it back.
+    spawn_fn = partial(individual_mushroom, spawn_woody_chance)
+    if woody:
+        revive(
+        actor,
         char="M",
         color=(127, 63, 63),
         name="Woody Mushroom",
-        ai_cls=lambda parent: SpawnerAI(parent, 0.01, lambda: individual_mushroom(woody_chance+0.1)),
-        equipment=Equipment(),
-        fighter=Fighter(hp=100, base_defense=0, base_power=3, dmg_multipliers = {"gnawing teeth": 100}),
-        inventory=Inventory(),
-        magic=Magic(),
-        level=Level(xp_given=1),
+        ai_cls=lambda parent: SpawnerAI(parent, 0.01, spawn_fn),
+        hp=100, base_defense=0, base_power=3, dmg_multipliers = {"gnawing teeth": 100},
+        xp_given=1,
         )
     else:
-        return Actor(
+        revive(
+        actor,
         char="m",
         color=(63, 63, 63),
         name="Mushroom",
-        ai_cls=lambda parent: SpawnerAI(parent, 0.01, lambda: individual_mushroom(woody_chance-0.05)),
-        equipment=Equipment(),
-        fighter=Fighter(hp=1, base_defense=0, base_power=3),
-        inventory=Inventory(),
-        magic=Magic(),
-        level=Level(xp_given=1),
+        ai_cls=lambda parent: SpawnerAI(parent, 0.01, spawn_fn),
+        hp=1, base_defense=0, base_power=3,
+        xp_given=1,
         )
 
+MUSHROOMS = Pool("mushroom", blank_actor, reset_mushroom)
+
+def mushroom_actor(woody, spawn_woody_chance):
+    """A mushroom whose own spawn is woody with `spawn_woody_chance`."""
+    return MUSHROOMS.acquire(woody, spawn_woody_chance)
+
+def mushroom_traits(actor):
+    """Return (woody, spawn_woody_chance) for an untouched mushroom actor,
+    or None for anything else."""
+    ai = getattr(actor, "ai", None)
+    if not isinstance(ai, SpawnerAI) or not isinstance(ai.spawn_fn, partial):
+        return None
+    if ai.spawn_fn.func is not individual_mushroom:
+        return None
+    if actor.fighter.hp < actor.fighter.max_hp or actor.inventory.items:
+        return None
+    return (actor.name == "Woody Mushroom", ai.spawn_fn.args[0])
+
 def mushroom():
     return [individual_mushroom() for _ in range(0, 7)]
 
 def woody_mushroom():
     return [individual_mushroom(0.9) for _ in range(0, 7)]
 
+IMP_SPELL = SpellConstraints(max_tokens=12, max_damage=20)
+
 def imp_spell(imp):
-    def is_valid(spell):
-        base_damage = spell.attributes.get("base_damage", 0)
-        if base_damage > 20:
-            return False
-        return True
-    return random_spell_with_constraints(is_valid, [i.token for i in imp.inventory.items])
+    return spell_space().random_spell(IMP_SPELL, imp.inventory.token_counts)
 
 def imp():
     return [Actor(
@@ -187,20 +330,22 @@ def giant_rat():
         rat_list.append(gr)
     return rat_list
 
-def squirrel():
-    sq = Actor(
+def reset_squirrel(sq):
+    revive(
+    sq,
     char=".",
     color=(127, 127, 0),
     name="Squirrel (super harmless)",
     ai_cls=Neutral,
-    equipment=Equipment(),
-    fighter=Fighter(hp=1, base_defense=2, base_power=3, dmg_multipliers={"fire": -0.2}),
-    magic=Magic(),
-    inventory=Inventory(),
-    level=Level(xp_given=175),
+    hp=1, base_defense=2, base_power=3, dmg_multipliers={"fire": -0.2},
+    xp_given=175,
     )
     sq.magic.spell_inventory.bump_spell_free = SHARED_GRIMOIRE["squirrel_bump_spell"]
-    return[sq]
+
+SQUIRRELS = Pool("squirrel", blank_actor, reset_squirrel)
+
+def squirrel():
+    return [SQUIRRELS.acquire()]
 
 
 the_blender = Item(
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
-from typing import Iterable, Iterator, Optional, TYPE_CHECKING
+from typing import Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np  # type: ignore
 from tcod.console import Console
 
 from entity import Actor, Item
+from colony import DEFAULT_CAP, MushroomColony
+from connectivity import Regions
+from placement import EntitySet, Placement
 from tile_types import wall, SHROUD
 
 if TYPE_CHECKING:
@@ -19,7 +22,8 @@ class GameMap:
     ):
         self.engine = engine
         self.width, self.height = width, height
-        self.entities = set(entities)
+        self.placement = Placement(self)
+        self.entities = entities
         self.tiles = np.full((width, height), fill_value=wall, order="F")
 
         self.visible = np.full(
@@ -32,6 +36,27 @@ class GameMap:
         self.downstairs_location = (0, 0)
         self.new_item_queue = []
 
+        # Bumped whenever tiles change, so caches derived from the terrain
+        # know when to recompute.
+        self.terrain_version = 0
+        self.fov_key = None
+        self.regions = Regions(self)
+
+        self.colony = MushroomColony(self)
+
+    @property
+    def entities(self) -> EntitySet:
+        return self._entities
+
+    @entities.setter
+    def entities(self, entities: Iterable[Entity]) -> None:
+        self._entities = EntitySet(entities, self.placement)
+        self.placement.rebuild()
+
+    def terrain_changed(self) -> None:
+        """Invalidate everything computed from the current tiles."""
+        self.terrain_version += 1
+
     def queue_add_entity(self, entity):
         self.new_item_queue.append(entity)
 
@@ -53,6 +78,13 @@ class GameMap:
             if isinstance(entity, Actor) and entity.is_alive
         )
 
+    def actor_positions(self) -> Tuple[List[Actor], np.ndarray, np.ndarray]:
+        """Return the living actors along with arrays of their x and y."""
+        actors = list(self.actors)
+        xs = np.fromiter((a.x for a in actors), dtype=np.intp, count=len(actors))
+        ys = np.fromiter((a.y for a in actors), dtype=np.intp, count=len(actors))
+        return actors, xs, ys
+
     @property
     def items(self) -> Iterator[Item]:
         yield from (entity for entity in self.entities if isinstance(entity, Item))
@@ -68,14 +100,14 @@ class GameMap:
             ):
                 return entity
 
-        return None
+        return self.colony.materialize(location_x, location_y)
 
     def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
         for actor in self.actors:
             if actor.x == x and actor.y == y:
                 return actor
 
-        return None
+        return self.colony.materialize(x, y)
 
     def in_bounds(self, x: int, y: int) -> bool:
         """Return True if x and y are inside of the bounds of this map."""
@@ -96,6 +128,12 @@ class GameMap:
             default=SHROUD,
         )
 
+        # Dormant mushrooms draw like the actors they stand in for.
+        for (woody, char, fg) in ((False, "m", (63, 63, 63)), (True, "M", (127, 63, 63))):
+            shown = self.colony.member & (self.colony.woody == woody) & self.visible
+            console.ch[0 : self.width, 0 : self.height][shown] = ord(char)
+            console.fg[0 : self.width, 0 : self.height][shown] = fg
+
         entities_sorted_for_rendering = sorted(
             self.entities, key=lambda x: x.render_order.value
         )
@@ -121,7 +159,9 @@ class GameWorld:
         max_rooms: int,
         room_min_size: int,
         room_max_size: int,
-        current_floor: int = 0
+        current_floor: int = 0,
+        mushroom_cap: int = DEFAULT_CAP,
+        generator: str = "rooms",
     ):
         self.engine = engine
 
@@ -135,11 +175,16 @@ class GameWorld:
 
         self.current_floor = current_floor
 
-    def generate_floor(self) -> None:
-        from procgen import generate_dungeon
+        # Most dormant mushrooms a floor's colony may grow to.
+        self.mushroom_cap = mushroom_cap
 
+        # Which of procgen.GENERATORS builds new floors.
+        self.generator = generator
+
+    def generate_floor(self) -> None:
+        from procgen import GENERATORS
 
-        self.engine.game_map = generate_dungeon(
+        self.engine.game_map = GENERATORS[self.generator](
             max_rooms=self.max_rooms,
             room_min_size=self.room_min_size,
             room_max_size=self.room_max_size,
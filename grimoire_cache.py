@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+
+from components.magic import intern_spell
+from components.magic.token import token_instances
+
+# Next to the game's modules, so it doesn't depend on the working directory.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grimoire_cache")
+FORMAT_VERSION = 1
+
+
+def token_digest(categories):
+    """Hash the registered tokens and the category limits a grimoire was
+    generated for, so a cached file is ignored once either changes."""
+    h = hashlib.sha1()
+    h.update(str(FORMAT_VERSION).encode())
+    for token in token_instances():
+        h.update(repr((type(token).__name__, sorted(vars(token).items()))).encode())
+    for (category, constraints) in sorted(categories.items()):
+        h.update(repr((category, constraints.key)).encode())
+    return h.hexdigest()[:16]
+
+
+def encode_spell(spell):
+    """Spells are stored as indices into `token_instances()` plus their
+    connection lists. Indices rather than token ids, since the range
+    tokens share an id but not a range."""
+    if spell is None:
+        return None
+    index = {id(token): i for (i, token) in enumerate(token_instances())}
+    return [[index[id(token)] for token in spell.tokens], spell.connections]
+
+
+def decode_spell(data):
+    if data is None:
+        return None
+    tokens = token_instances()
+    (indices, connections) = data
+    return intern_spell([tokens[i] for i in indices], [list(ids) for ids in connections])
+
+
+def cache_path(seed, digest):
+    return os.path.join(CACHE_DIR, f"{seed}-{digest}.json")
+
+
+def load_grimoire(seed, digest):
+    """Return {category: [Spell or None]} from the cache, or None on a miss."""
+    try:
+        with open(cache_path(seed, digest)) as f:
+            data = json.load(f)
+        if data["version"] != FORMAT_VERSION or data["tokens"] != digest:
+            return None
+        return {
+            category: [decode_spell(spell) for spell in spells]
+            for (category, spells) in data["spells"].items()
+        }
+    except (OSError, ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def save_grimoire(seed, digest, grimoire):
+    data = {
+        "version": FORMAT_VERSION,
+        "tokens": digest,
+        "seed": seed,
+        "spells": {
+            category: [encode_spell(spell) for spell in spells]
+            for (category, spells) in grimoire.items()
+        },
+    }
+    path = cache_path(seed, digest)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+    except OSError:
+        # The cache is only an optimization.
+        pass
@@ -159,12 +159,17 @@ class EventHandler(BaseEventHandler):
 
         self.engine.game_map.apply_new_item_queue()
 
+        import entity_factories
+
         for entity in removed:
             self.engine.game_map.entities.remove(entity)
+            entity_factories.release(entity)
 
         self.engine.check_environment_interactions()
 
         self.engine.update_fov()
+        self.engine.turn += 1
+        self.engine.message_log.new_turn()
         return True
 
     def ev_mousemotion(self, event: tcod.event.MouseMotion) -> None:
@@ -608,7 +613,7 @@ def cast_action(player, spell, engine):
     if not spell:
         return None
 
-    if spell.can_cast(player.inventory):
+    if player.magic.can_cast(spell):
         if spell.needs_target():
             attributes = spell.attributes
             def callback(xy):
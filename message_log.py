@@ -1,4 +1,4 @@
-from typing import Iterable, List, Reversible, Tuple
+from typing import Iterable, Iterator, List, Optional, Reversible, Tuple
 import textwrap
 
 import tcod
@@ -6,12 +6,146 @@ import tcod
 import color
 
 
+def outcome_text(outcome: str, amount: int) -> str:
+    """Describe the result returned by `Fighter.damage`."""
+    if outcome == "damage":
+        return f"deals {amount} damage"
+    if outcome == "immune":
+        return "deals no damage"
+    if outcome == "heal":
+        return f"heals for {amount}"
+    return "nothing happens"
+
+
+def times(count: int) -> str:
+    """Return how often something happened, or nothing if just once."""
+    if count == 1:
+        return ""
+    if count == 2:
+        return " twice"
+    return f" {count} times"
+
+
+def plural(name: str, count: int) -> str:
+    """Return `name` prefixed by `count`, pluralized if needed."""
+    if count == 1:
+        return name
+    # "Squirrel (super harmless)" becomes "2 Squirrels (super harmless)".
+    head, sep, tail = name.partition(" (")
+    return f"{count} {head}s{sep}{tail}"
+
+
+class MessageEvent:
+    """A structured log entry which is only turned into text when rendered.
+
+    Events of the same kind with identical fields that are logged during the
+    same turn are merged into a single entry. `hits` maps the serial of
+    every entity involved, in the order they were first logged, to how many
+    of the merged events were about it.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        target: str,
+        *,
+        target_id: Optional[int] = None,
+        outcome: Optional[str] = None,
+        amount: int = 0,
+        damage_type: Optional[str] = None,
+        scale: Optional[str] = None,
+        shape: Optional[str] = None,
+    ):
+        self.kind = kind
+        self.target = target
+        self.hits = {target_id: 1}
+        self.outcome = outcome
+        self.amount = amount
+        self.damage_type = damage_type
+        self.scale = scale
+        self.shape = shape
+        self.turn = 0
+
+    @property
+    def key(self) -> Tuple:
+        return (
+            self.kind,
+            self.turn,
+            self.target,
+            self.outcome,
+            self.amount,
+            self.damage_type,
+            self.scale,
+            self.shape,
+        )
+
+    @property
+    def target_ids(self) -> List[Optional[int]]:
+        """The distinct serials involved, in the order they were logged."""
+        return list(self.hits)
+
+    @property
+    def count(self) -> int:
+        """How many distinct entities the event is about."""
+        return len(self.hits)
+
+    @property
+    def total(self) -> int:
+        """How many events were merged into this one."""
+        return sum(self.hits.values())
+
+    def merge(self, other: "MessageEvent") -> None:
+        """Fold an equivalent event into this one."""
+        for (target_id, hits) in other.hits.items():
+            self.hits[target_id] = self.hits.get(target_id, 0) + hits
+
+    def text(self) -> str:
+        count = self.count
+        targets = plural(self.target, count)
+        # When a target was hit more than once the amount is per hit, not
+        # per target.
+        repeated = self.total > count
+        repeats = times(self.total) if repeated else ""
+        each = " each time" if repeated else " each" if count > 1 else ""
+        if self.kind == "spell_hit":
+            return (
+                f"A {self.scale} {self.shape} of {self.damage_type} hits {targets}{repeats} "
+                f"and {outcome_text(self.outcome, self.amount)}{each}"
+            )
+        if self.kind == "heal":
+            verb = "heal" if count > 1 else "heals"
+            return f"{targets} {verb} for {self.amount}{repeats or each}!"
+        if self.kind == "environment":
+            verb = "are" if count > 1 else "is"
+            return (
+                f"{targets} {verb} standing in {self.damage_type} which "
+                f"{outcome_text(self.outcome, self.amount)}{repeats or each}."
+            )
+        if self.kind == "summon":
+            # Merged summons each brought `amount` creatures.
+            total = self.total * self.amount
+            if total > 1:
+                return f"{total} {self.target}s appear"
+            return f"a {self.target} appears"
+        raise ValueError(f"Unknown message event kind: {self.kind}")
+
+
 class Message:
-    def __init__(self, text: str, fg: Tuple[int, int, int]):
-        self.plain_text = text
+    def __init__(
+        self, text: Optional[str], fg: Tuple[int, int, int], event: Optional[MessageEvent] = None
+    ):
+        self._text = text
+        self.event = event
         self.fg = fg
         self.count = 1
 
+    @property
+    def plain_text(self) -> str:
+        """The message text, formatted from its event if it has one."""
+        if self.event is not None:
+            return self.event.text()
+        return self._text
+
     @property
     def full_text(self) -> str:
         """The full text of this message, including the count if necessary."""
@@ -23,6 +157,11 @@ class Message:
 class MessageLog:
     def __init__(self) -> None:
         self.messages: List[Message] = []
+        self.turn = 0
+
+    def new_turn(self) -> None:
+        """Stop merging events into the entries logged so far."""
+        self.turn += 1
 
     def add_message(
         self, text: str, fg: Tuple[int, int, int] = color.white, *, stack: bool = True,
@@ -34,11 +173,38 @@ class MessageLog:
         If `stack` is True then the message can stack with a previous message
         of the same text.
         """
-        if stack and self.messages and text == self.messages[-1].plain_text:
+        if (
+            stack
+            and self.messages
+            and self.messages[-1].event is None
+            and text == self.messages[-1].plain_text
+        ):
             self.messages[-1].count += 1
         else:
             self.messages.append(Message(text, fg))
 
+    def add_event(
+        self, event: MessageEvent, fg: Tuple[int, int, int] = color.white
+    ) -> None:
+        """Add a structured event to this log.
+
+        The event is merged into the previous entry if that entry is an
+        equivalent event from the same turn.
+        """
+        event.turn = self.turn
+        if self.messages:
+            last = self.messages[-1]
+            if last.event is not None and last.event.key == event.key and last.fg == fg:
+                last.event.merge(event)
+                return
+        self.messages.append(Message(None, fg, event))
+
+    def events(self, kind: Optional[str] = None) -> Iterator[MessageEvent]:
+        """Iterate over the logged events, optionally only those of `kind`."""
+        for message in self.messages:
+            if message.event is not None and (kind is None or message.event.kind == kind):
+                yield message.event
+
     def render(
         self, console: tcod.Console, x: int, y: int, width: int, height: int,
     ) -> None:
@@ -34,6 +34,9 @@ class PathingCache:
         for entity in self.engine.game_map.actors:
             cost[entity.x, entity.y] = 1000
             dist[entity.x, entity.y] = 50
+        colony = self.engine.game_map.colony.member
+        cost[colony] = 1000
+        dist[colony] = 50
         tcod.path.dijkstra2d(dist, cost, 2, 3)
         self.token_flow = dist
 
@@ -45,6 +48,7 @@ class PathingCache:
                 dist[entity.x, entity.y] = 0
             else:
                 cost[entity.x, entity.y] = 1000
+        cost[self.engine.game_map.colony.member] = 1000
         tcod.path.dijkstra2d(dist, cost, 2, 3)
         self.squirrel_flow = dist
 
@@ -55,6 +59,9 @@ class PathingCache:
             if entity is not self.engine.player:
                 cost[entity.x, entity.y] = 1000
                 dist[entity.x, entity.y] = 50
+        colony = self.engine.game_map.colony.member
+        cost[colony] = 1000
+        dist[colony] = 50
         dist[self.engine.player.x, self.engine.player.y] = 0
         tcod.path.dijkstra2d(dist, cost, 2, 3)
         self.player_flow = dist
@@ -66,6 +73,7 @@ class PathingCache:
         for entity in self.engine.game_map.actors:
             if entity is not self.engine.player:
                 cost[entity.x, entity.y] = 1000
+        cost[self.engine.game_map.colony.member] = 1000
         dist[self.engine.player.x, self.engine.player.y] = 0
         tcod.path.dijkstra2d(dist, cost, 2, 3)
         self.anti_player_flow = (dist * np.where(dist < 10000, -1, 1))*dist
@@ -76,6 +84,7 @@ class PathingCache:
         for entity in self.engine.game_map.actors:
             if "Mushroom" in entity.name:
                 dist[entity.x, entity.y] = 0
+        dist[self.engine.game_map.colony.member] = 0
         tcod.path.dijkstra2d(dist, cost, 2, 3)
         self.mushroom_flow = dist
 
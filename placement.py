@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import random
+from typing import Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from entity import Entity
+    from game_map import GameMap
+
+
+class EntitySet(set):
+    """A map's entities, which tell the map's Placement as they come and go."""
+
+    def __init__(self, entities: Iterable[Entity] = (), placement: Optional[Placement] = None):
+        super().__init__(entities)
+        self.placement = placement
+
+    def add(self, entity: Entity) -> None:
+        super().add(entity)
+        self.placement.update(entity)
+
+    def remove(self, entity: Entity) -> None:
+        super().remove(entity)
+        self.placement.forget(entity)
+
+    def discard(self, entity: Entity) -> None:
+        super().discard(entity)
+        self.placement.forget(entity)
+
+
+class Placement:
+    """Free cells of a map, for placing new entities.
+
+    Each GameMap keeps one, counting the blocking entities on every cell.
+    The map's entity set reports additions and removals, and moves and
+    deaths are reported through `update`. Finding free cells then only
+    reads the window around the point asked about: walkable tiles with no
+    blocking entity and no dormant mushroom. Placing K entities costs O(K)
+    instead of a copy of the map and an entity scan.
+    """
+
+    def __init__(self, game_map: GameMap):
+        self.game_map = game_map
+        self.blockers = np.zeros((game_map.width, game_map.height), dtype=np.int16, order="F")
+        # The cell each counted entity was counted on.
+        self.counted: Dict[Entity, Tuple[int, int]] = {}
+
+    def update(self, entity: Entity) -> None:
+        """Count `entity` where it stands now, if it blocks and is on the map."""
+        self.forget(entity)
+        (x, y) = (entity.x, entity.y)
+        if entity.blocks_movement and entity in self.game_map.entities and self.game_map.in_bounds(x, y):
+            self.counted[entity] = (x, y)
+            self.blockers[x, y] += 1
+
+    def forget(self, entity: Entity) -> None:
+        cell = self.counted.pop(entity, None)
+        if cell is not None:
+            self.blockers[cell] -= 1
+
+    def rebuild(self) -> None:
+        """Count every entity of the map again from scratch."""
+        self.blockers[:] = 0
+        self.counted.clear()
+        for entity in self.game_map.entities:
+            self.update(entity)
+
+    def free(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        """Return which cells of the [x1, x2) x [y1, y2) window are free."""
+        window = (slice(x1, x2), slice(y1, y2))
+        return (
+            self.game_map.tiles["walkable"][window]
+            & (self.blockers[window] == 0)
+            & ~self.game_map.colony.member[window]
+        )
+
+    def cells_near(self, x: int, y: int, count: int, radius: int = 1) -> List[Tuple[int, int]]:
+        """Return up to `count` free cells within `radius` of (x, y).
+
+        Nearer rings are used up first, in random order within a ring; the
+        center counts as part of the first ring. The cells are only taken
+        once something is placed on them.
+        """
+        width, height = self.blockers.shape
+        x1 = max(0, x - radius)
+        y1 = max(0, y - radius)
+        x2 = max(x1, min(width, x + radius + 1))
+        y2 = max(y1, min(height, y + radius + 1))
+        (xs, ys) = np.nonzero(self.free(x1, y1, x2, y2))
+        xs += x1
+        ys += y1
+
+        rings = np.maximum(np.maximum(np.abs(xs - x), np.abs(ys - y)), 1)
+        noise = [random.random() for _ in range(len(xs))]
+        order = np.lexsort((noise, rings))[:count]
+        xs = xs[order]
+        ys = ys[order]
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def spawn(self, entities: Iterable[Entity], x: int, y: int, radius: int = 1) -> List[Entity]:
+        """Spawn copies of `entities` near (x, y), returning the ones that fit."""
+        entities = list(entities)
+        cells = self.cells_near(x, y, len(entities), radius)
+        return [
+            entity.spawn(self.game_map, cx, cy)
+            for (entity, (cx, cy)) in zip(entities, cells)
+        ]
+
+    def place(self, entities: Iterable[Entity], x: int, y: int, radius: int = 1) -> List[Entity]:
+        """Place `entities` themselves near (x, y), returning the ones that fit.
+
+        For freshly made entities, which need no copy. The ones that don't
+        fit go back to their pool.
+        """
+        import entity_factories
+
+        entities = list(entities)
+        cells = self.cells_near(x, y, len(entities), radius)
+        for (entity, (cx, cy)) in zip(entities, cells):
+            entity.place(cx, cy, self.game_map)
+        for entity in entities[len(cells):]:
+            entity_factories.release(entity)
+        return entities[: len(cells)]
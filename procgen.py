@@ -3,18 +3,20 @@ from collections import defaultdict
 import numpy as np
 import copy
 
-from collections import Counter
-
 import random
-from typing import Dict, Iterator, List, Tuple, TYPE_CHECKING
+from typing import Dict, List, Tuple, TYPE_CHECKING
 
 import tcod
 
 from entity import Item
 import entity_factories
+import connectivity
 from game_map import GameMap
+from spawn_tables import SpawnTable
+import stamping
 from tile_types import floor, down_stairs, TileLabel, up_stairs
-from components.magic.token import all_tokens
+from components.ai import RangedHostileEnemy
+from components.magic.token import token_instances
 
 
 if TYPE_CHECKING:
@@ -22,6 +24,11 @@ if TYPE_CHECKING:
     from entity import Entity
 
 
+# Share of walls in the noise caves grow from, and how many times it is
+# smoothed.
+CAVE_FILL = 0.45
+CAVE_SMOOTHING = 4
+
 max_monsters_by_floor = [
     (1, 2),
     (4, 3),
@@ -67,34 +74,25 @@ def get_max_value_for_floor(
     return current_value
 
 
-def get_entities_at_random(
-    weighted_chances_by_floor: Dict[int, List[Tuple[Entity, int]]],
-    number_of_entities: int,
-    floor: int,
-) -> List[Entity]:
-    entity_weighted_chances = {}
-
-    for key, values in weighted_chances_by_floor.items():
-        if key > floor:
-            break
-        else:
-            for value in values:
-                entity = value[0]
-                weighted_chance = value[1]
+SPAWN_TABLES: Dict[int, SpawnTable] = {}
 
+def spawn_table(floor: int) -> SpawnTable:
+    """Return the compiled spawn table of `floor`, compiling it on first use."""
+    table = SPAWN_TABLES.get(floor)
+    if table is None:
+        entity_weighted_chances = {}
+        for key, values in enemy_chances.items():
+            if key > floor:
+                break
+            for (entity, weighted_chance) in values:
                 entity_weighted_chances[entity] = weighted_chance
 
-    entities = list(entity_weighted_chances.keys())
-    entity_weighted_chance_values = list(entity_weighted_chances.values())
-
-    if entities:
-        chosen_entities = random.choices(
-            entities, weights=entity_weighted_chance_values, k=number_of_entities
+        table = SPAWN_TABLES[floor] = SpawnTable(
+            list(entity_weighted_chances.items()),
+            get_max_value_for_floor(max_monsters_by_floor, floor),
+            token_instances(),
         )
-
-        return [e for factory in chosen_entities for e in factory()]
-    else:
-        return []
+    return table
 
 
 class RectangularRoom:
@@ -116,6 +114,11 @@ class RectangularRoom:
         """Return the inner area of this room as a 2D array index."""
         return slice(self.x1 + 1, self.x2), slice(self.y1 + 1, self.y2)
 
+    @property
+    def outer(self) -> Tuple[slice, slice]:
+        """Return the whole room, walls included, as a 2D array index."""
+        return slice(self.x1, self.x2 + 1), slice(self.y1, self.y2 + 1)
+
     def contains(self, x, y):
         return (
             self.x1 <= x
@@ -135,50 +138,81 @@ class RectangularRoom:
         )
 
 
-def place_entities(room: RectangularRoom, dungeon: GameMap, floor_number: int,) -> None:
-    number_of_monsters = random.randint(
-        0, get_max_value_for_floor(max_monsters_by_floor, floor_number)
-    )
-    monsters: List[Entity] = get_entities_at_random(
-        enemy_chances, number_of_monsters, floor_number
-    )
-
-    tokens = all_tokens()
-
-    for monster in monsters:
-        monster.magic.assure_castability(monster.magic.spell_inventory.ranged_spell, 10)
-        monster.magic.assure_castability(monster.magic.spell_inventory.bump_spell, 10)
-        monster.magic.assure_castability(monster.magic.spell_inventory.heal_spell, 10)
-        for _ in range(30):
-            token = random.choice(tokens)
-            monster.inventory.add_token(token())
-
-    for entity in monsters:
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
-
-        if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
+def place_entities(rooms: List[RectangularRoom], dungeon: GameMap, floor_number: int,) -> None:
+    """Fill `rooms` with monsters drawn from the floor's spawn table.
+
+    Room counts, monster kinds, token grants and positions are all drawn
+    in batches for every room at once; only the factories run per monster.
+    """
+    table = spawn_table(floor_number)
+    rng = np.random.default_rng(random.getrandbits(64))
+
+    counts = table.draw_counts(rng, len(rooms))
+    monsters: List[Entity] = []
+    homes = []
+    factories = table.draw_factories(rng, int(counts.sum()))
+    for (room, factory) in zip(np.repeat(np.arange(len(rooms)), counts).tolist(), factories):
+        for monster in factory():
+            monsters.append(monster)
+            homes.append(room)
+    if not monsters:
+        return
+
+    # A random cell inside each monster's room, walls excluded.
+    homes = np.array(homes, dtype=np.intp)
+    bounds = np.array([(room.x1, room.y1, room.x2, room.y2) for room in rooms], dtype=np.intp)[homes]
+    xs = rng.integers(bounds[:, 0] + 1, bounds[:, 2]).tolist()
+    ys = rng.integers(bounds[:, 1] + 1, bounds[:, 3]).tolist()
+
+    # Cells already holding an entity, so collisions are one lookup each.
+    occupied = np.zeros((dungeon.width, dungeon.height), dtype=bool, order="F")
+    for entity in dungeon.entities:
+        if dungeon.in_bounds(entity.x, entity.y):
+            occupied[entity.x, entity.y] = True
+    walkable = dungeon.tiles["walkable"]
+
+    placed = []
+    for (i, (x, y)) in enumerate(zip(xs, ys)):
+        if walkable[x, y] and not dungeon.colony.member[x, y] and not occupied[x, y]:
+            occupied[x, y] = True
+            placed.append(i)
+
+    # Fresh monsters that found no cell go back to their pools.
+    last = {id(monsters[i]): i for i in placed}
+    for entity in {id(entity): entity for entity in monsters}.values():
+        if id(entity) not in last:
+            entity_factories.release(entity)
+
+    # Tokens are only drawn for the monsters that were placed.
+    grants = table.draw_tokens(rng, len(placed))
+    for (i, granted) in zip(placed, grants):
+        entity = monsters[i]
+        entity.magic.assure_castability(entity.magic.spell_inventory.ranged_spell, 10)
+        entity.magic.assure_castability(entity.magic.spell_inventory.bump_spell, 10)
+        entity.magic.assure_castability(entity.magic.spell_inventory.heal_spell, 10)
+        entity.inventory.add_tokens(table.token_stacks(granted))
+        if isinstance(entity.ai, RangedHostileEnemy) and entity.ai.spell_fn:
+            # Pick the spell now rather than on the monster's first turn.
+            entity.ai.choose_spell()
+
+        (x, y) = (xs[i], ys[i])
+        if dungeon.colony.take(entity, x, y):
+            continue
+        if last[id(entity)] == i:
+            # Factory output is fresh, so it goes on the map as it is.
+            entity.place(x, y, dungeon)
+        else:
+            # Some factories hand back one entity several times. The earlier
+            # ones are copies taken after their own grants.
             entity.spawn(dungeon, x, y)
 
 
 def tunnel_between(
     start: Tuple[int, int], end: Tuple[int, int]
-) -> Iterator[Tuple[int, int]]:
-    """Return an L-shaped tunnel between these two points."""
-    x1, y1 = start
-    x2, y2 = end
-    if random.random() < 0.5:  # 50% chance.
-        # Move horizontally, then vertically.
-        corner_x, corner_y = x2, y1
-    else:
-        # Move vertically, then horizontally.
-        corner_x, corner_y = x1, y2
-
-    # Generate the coordinates for this tunnel.
-    for x, y in tcod.los.bresenham((x1, y1), (corner_x, corner_y)).tolist():
-        yield x, y
-    for x, y in tcod.los.bresenham((corner_x, corner_y), (x2, y2)).tolist():
-        yield x, y
+) -> stamping.Cells:
+    """Return the cells of an L-shaped tunnel between these two points."""
+    # 50% chance to move horizontally, then vertically.
+    return stamping.l_corridor(start, end, horizontal_first=random.random() < 0.5)
 
 
 def generate_dungeon(
@@ -192,8 +226,12 @@ def generate_dungeon(
     """Generate a new dungeon map."""
     player = engine.player
     dungeon = GameMap(engine, map_width, map_height, entities=[player])
+    dungeon.colony.cap = engine.game_world.mushroom_cap
 
     rooms: List[RectangularRoom] = []
+    # The cells covered by some room, walls included. A candidate only has
+    # to look at its own footprint here instead of at every room so far.
+    occupied = np.zeros((dungeon.width, dungeon.height), dtype=bool, order="F")
 
     center_of_last_room = (0, 0)
 
@@ -207,10 +245,11 @@ def generate_dungeon(
         # "RectangularRoom" class makes rectangles easier to work with
         new_room = RectangularRoom(x, y, room_width, room_height)
 
-        # Run through the other rooms and see if they intersect with this one.
-        if any(new_room.intersects(other_room) for other_room in rooms):
+        # See if any other room overlaps this one, or shares a wall with it.
+        if occupied[new_room.outer].any():
             continue  # This room intersects, so go to the next attempt.
         # If there are no intersections then the room is valid.
+        occupied[new_room.outer] = True
 
         # Dig out this rooms inner area.
         dungeon.tiles[new_room.inner] = floor
@@ -222,21 +261,100 @@ def generate_dungeon(
         else:  # All rooms after the first.
             # Dig out a tunnel between this room and the previous one.
             touched_rooms = {len(rooms)}
-            for x, y in tunnel_between(rooms[-1].center, new_room.center):
-                if (TileLabel(dungeon.tiles[x,y]["label"]).name == "Wall"):
-                    dungeon.tiles[x, y] = floor
+            tunnel = tunnel_between(rooms[-1].center, new_room.center)
+            stamping.stamp(dungeon.tiles, tunnel, floor, only=TileLabel.Wall)
 
             center_of_last_room = new_room.center
 
-        place_entities(new_room, dungeon, engine.game_world.current_floor)
-
-        dungeon.downstairs_location = center_of_last_room
-
         # Finally, append the new room to the list.
         rooms.append(new_room)
 
+    place_entities(rooms, dungeon, engine.game_world.current_floor)
+    finish_floor(dungeon, engine, center_of_last_room)
+    return dungeon
+
+
+def generate_caves(
+    max_rooms: int,
+    room_min_size: int,
+    room_max_size: int,
+    map_width: int,
+    map_height: int,
+    engine: Engine,
+) -> GameMap:
+    """Generate a new cave map.
+
+    The caves are grown from noise by cellular automaton smoothing and
+    only their largest connected region is kept. Monsters are placed per
+    room_max_size square of the map that is mostly cave, so `max_rooms`
+    is not used.
+    """
+    player = engine.player
+    dungeon = GameMap(engine, map_width, map_height, entities=[player])
+    dungeon.colony.cap = engine.game_world.mushroom_cap
+
+    rng = np.random.default_rng(random.getrandbits(64))
+    count = 0
+    while count == 0:
+        (labels, count) = connectivity.label_regions(~cave_walls(map_width, map_height, rng))
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0
+    cave = labels == sizes.argmax()
+    dungeon.tiles[cave] = floor
+    # The cave is one region by construction, so there is nothing to label
+    # again or connect.
+    dungeon.regions.assume(cave.astype(np.int32), 1)
+
+    (xs, ys) = np.nonzero(cave)
+    start = random.randrange(len(xs))
+    player.place(int(xs[start]), int(ys[start]), dungeon)
+
+    # The downstairs go as far into the cave from the player as it gets.
+    dist = np.full(cave.shape, np.iinfo(np.int32).max, dtype=np.int32)
+    dist[player.x, player.y] = 0
+    tcod.path.dijkstra2d(dist, cave.astype(np.int8), 2, 3, out=dist)
+    dist[~cave] = -1
+    downstairs = np.unravel_index(dist.argmax(), dist.shape)
+
+    rooms = []
+    for x in range(0, map_width - room_max_size, room_max_size):
+        for y in range(0, map_height - room_max_size, room_max_size):
+            room = RectangularRoom(x, y, room_max_size, room_max_size)
+            if cave[room.inner].mean() >= 0.5:
+                rooms.append(room)
+    place_entities(rooms, dungeon, engine.game_world.current_floor)
+
+    finish_floor(dungeon, engine, (int(downstairs[0]), int(downstairs[1])))
+    return dungeon
+
+
+def cave_walls(width: int, height: int, rng: np.random.Generator, fill: float = CAVE_FILL, steps: int = CAVE_SMOOTHING) -> np.ndarray:
+    """Return a wall mask grown from noise by cellular automaton smoothing.
+
+    Each step counts the walls around every cell with a 3x3 box sum over
+    the padded mask; a cell becomes wall with more than 4 walls around it,
+    floor with fewer, and stays as it is with exactly 4.
+    """
+    walls = rng.random((width, height)) < fill
+    for _ in range(steps):
+        padded = np.pad(walls, 1, constant_values=True).astype(np.int8)
+        around = -walls.astype(np.int8)
+        for dx in range(3):
+            for dy in range(3):
+                around += padded[dx : dx + width, dy : dy + height]
+        walls = (around > 4) | ((around == 4) & walls)
+    walls[[0, -1], :] = True
+    walls[:, [0, -1]] = True
+    return walls
+
+
+def finish_floor(dungeon: GameMap, engine: Engine, downstairs: Tuple[int, int]) -> None:
+    """Put in the stairs and the per-floor features, and bring the familiar."""
+    player = engine.player
+    dungeon.downstairs_location = downstairs
+
     if engine.game_world.current_floor == 3:
-        block_access((player.x, player.y), center_of_last_room, dungeon)
+        block_access((player.x, player.y), downstairs, dungeon)
 
     if engine.game_world.current_floor == 5:
         entity = entity_factories.the_blender
@@ -246,24 +364,40 @@ def generate_dungeon(
         dungeon.tiles[dungeon.downstairs_location] = down_stairs
 
     dungeon.tiles[player.x, player.y] = up_stairs
-    engine.familiar = engine.familiar.spawn(dungeon, player.x+1, player.y)
+    ensure_connected(dungeon, (player.x, player.y))
+    if dungeon.tiles["walkable"][player.x+1, player.y]:
+        (x, y) = (player.x+1, player.y)
+    else:
+        (x, y) = (dungeon.placement.cells_near(player.x, player.y, 1, radius=2) or [(player.x, player.y)])[0]
+    engine.familiar = engine.familiar.spawn(dungeon, x, y)
 
-    return dungeon
+
+GENERATORS = {
+    "rooms": generate_dungeon,
+    "caves": generate_caves,
+}
+
+
+def ensure_connected(dungeon: GameMap, start: Tuple[int, int]) -> None:
+    """Tunnel every walkable region that can't be reached from `start` into
+    the one that can."""
+    regions = dungeon.regions
+    while regions.count > 1:
+        home = regions.mask(regions.region_at(*start))
+        (xs, ys) = np.nonzero(home)
+        (strays_x, strays_y) = np.nonzero((regions.labels != 0) & ~home)
+        (x, y) = (int(strays_x[0]), int(strays_y[0]))
+        nearest = np.argmin((xs - x) ** 2 + (ys - y) ** 2)
+        tunnel = tunnel_between((x, y), (int(xs[nearest]), int(ys[nearest])))
+        stamping.stamp(dungeon.tiles, tunnel, floor, only=TileLabel.Wall)
+        dungeon.terrain_changed()
 
 
 def block_access(start, end, dungeon):
-    while True:
-        cost = np.array(dungeon.tiles["walkable"], dtype=np.int16)
-        for entity in dungeon.actors:
-            cost[entity.x, entity.y] = 0
-        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
-        pathfinder = tcod.path.Pathfinder(graph)
-        pathfinder.add_root(start)
-        path = pathfinder.path_to(end)[1:].tolist()
-
-        if not path:
-            return
-
-        i = path[len(path)//2]
+    """Wall `end` off from `start` with woody mushrooms on the fewest cells."""
+    free = dungeon.tiles["walkable"] & ~dungeon.colony.member
+    for entity in dungeon.actors:
+        free[entity.x, entity.y] = False
+    for (x, y) in connectivity.chokepoints(free, start, end):
         entity = entity_factories.individual_mushroom(1.0)
-        entity.spawn(dungeon, i[0], i[1])
+        dungeon.colony.take(entity, x, y, force=True)
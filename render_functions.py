@@ -14,9 +14,10 @@ def get_names_at_location(x: int, y: int, game_map: GameMap) -> str:
     if not game_map.in_bounds(x, y) or not game_map.visible[x, y]:
         return ""
 
-    names = ", ".join(
-        entity.name for entity in game_map.entities if entity.x == x and entity.y == y
-    )
+    names = [entity.name for entity in game_map.entities if entity.x == x and entity.y == y]
+    if game_map.colony.member[x, y]:
+        names.append("Woody Mushroom" if game_map.colony.woody[x, y] else "Mushroom")
+    names = ", ".join(names)
 
     return names.capitalize()
 
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from typing import Callable, List, Sequence, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from components.magic.token import Token
+    from entity import Entity
+
+# Tokens every placed monster starts out carrying.
+TOKENS_PER_MONSTER = 30
+
+
+class AliasTable:
+    """Draws from a fixed discrete distribution in O(1) per draw.
+
+    This is Vose's alias method: each of the n columns holds the chance of
+    keeping its own index and the index it hands the rest to, so a draw is
+    one uniform column plus one coin flip, and a batch of draws is a pair
+    of array lookups.
+    """
+
+    def __init__(self, weights: Sequence[float]):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        self.prob = weights * n / weights.sum()
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if self.prob[i] < 1.0]
+        large = [i for i in range(n) if self.prob[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.alias[s] = l
+            self.prob[l] -= 1.0 - self.prob[s]
+            (small if self.prob[l] < 1.0 else large).append(l)
+        # Whatever is left is 1 up to rounding.
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def draw(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        """Return `size` indices drawn with probability proportional to the weights."""
+        columns = rng.integers(0, len(self.prob), size=size)
+        return np.where(rng.random(size) < self.prob[columns], columns, self.alias[columns])
+
+
+class SpawnTable:
+    """What gets placed on one floor, compiled for drawing in batches.
+
+    `chances` are the (factory, weight) pairs in effect on the floor and
+    `max_monsters` the most factory calls a room gets. Every monster also
+    draws TOKENS_PER_MONSTER tokens uniformly from `tokens`.
+    """
+
+    def __init__(
+        self,
+        chances: List[Tuple[Callable[[], List[Entity]], int]],
+        max_monsters: int,
+        tokens: Sequence[Token],
+    ):
+        self.factories = [factory for (factory, weight) in chances]
+        weights = [weight for (factory, weight) in chances]
+        self.monster_table = AliasTable(weights) if sum(weights) > 0 else None
+        self.max_monsters = max_monsters
+        self.tokens = list(tokens)
+        self.token_table = AliasTable([1] * len(self.tokens))
+
+    def draw_counts(self, rng: np.random.Generator, rooms: int) -> np.ndarray:
+        """Return how many factories to call for each of `rooms` rooms."""
+        if self.monster_table is None:
+            return np.zeros(rooms, dtype=np.intp)
+        return rng.integers(0, self.max_monsters + 1, size=rooms)
+
+    def draw_factories(self, rng: np.random.Generator, count: int) -> List[Callable[[], List[Entity]]]:
+        if self.monster_table is None:
+            return []
+        return [self.factories[i] for i in self.monster_table.draw(rng, count).tolist()]
+
+    def draw_tokens(self, rng: np.random.Generator, monsters: int) -> np.ndarray:
+        """Return a (monsters, len(tokens)) array of token counts, one row
+        per monster."""
+        size = len(self.tokens)
+        drawn = self.token_table.draw(rng, monsters * TOKENS_PER_MONSTER)
+        rows = np.repeat(np.arange(monsters), TOKENS_PER_MONSTER)
+        return np.bincount(rows * size + drawn, minlength=monsters * size).reshape(monsters, size)
+
+    def token_stacks(self, counts: np.ndarray) -> List[Tuple[Token, int]]:
+        """Turn one row of `draw_tokens` into (token, count) pairs."""
+        return [(self.tokens[i], int(counts[i])) for i in np.flatnonzero(counts).tolist()]
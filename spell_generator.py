@@ -1,142 +1,360 @@
-from random import Random, randint, shuffle
+from random import Random, shuffle
 from components.magic.token import *
-from components.magic import Spell
+from components.magic.token import token_instances
+import random as random_module
+from components.magic import intern_spell
+from grimoire_cache import load_grimoire, save_grimoire, token_digest
 
 SHARED_GRIMOIRE = {}
 
 
-def random_small_ranged():
-    def is_valid(spell):
-        if len(spell.tokens) > 6:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("requires_target", False):
-            return False
-        if attributes.get("range", 0) < 4 or attributes.get("range", 0) <= attributes.get("AOE_radius", 0):
-            return False
-        base_damage = attributes.get("base_damage", 0)
-        if base_damage > 3 or base_damage < 1:
-            return False
-        return True
-    return random_spell_with_constraints(is_valid)
+class SpellConstraints:
+    """Declarative limits on a generated spell.
 
-def random_small_construction():
-    def is_valid(spell):
-        if len(spell.tokens) > 6:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("requires_target", False):
-            return False
-        if attributes.get("range", 0) < 4 or attributes.get("range", 0) <= attributes.get("AOE_radius", 0):
-            return False
-        if attributes.get("material") != "wall" and attributes.get("material") != "screaming elemental void":
-            return False
-        return True
-    return random_spell_with_constraints(is_valid)
+    Bounds are inclusive and read the attributes the same way the old
+    `is_valid` checks did, with missing numbers counting as 0.
+    """
+    def __init__(self, max_tokens=12, required=(), min_range=None, max_range=None,
+                 range_exceeds_radius=False, max_radius=None, min_damage=None,
+                 max_damage=None, materials=None):
+        self.max_tokens = max_tokens
+        self.required = tuple(required)
+        self.min_range = min_range
+        self.max_range = max_range
+        self.range_exceeds_radius = range_exceeds_radius
+        self.max_radius = max_radius
+        self.min_damage = min_damage
+        self.max_damage = max_damage
+        self.materials = None if materials is None else tuple(materials)
 
-def random_small_summon():
-    def is_valid(spell):
-        if len(spell.tokens) > 6:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("is_summon", False):
-            return False
-        return True
-    return random_spell_with_constraints(is_valid)
+    @property
+    def key(self):
+        return (self.max_tokens, self.required, self.min_range, self.max_range,
+                self.range_exceeds_radius, self.max_radius, self.min_damage,
+                self.max_damage, self.materials)
 
-def random_small_bump():
-    def is_valid(spell):
-        if len(spell.tokens) > 6:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("requires_target", False):
+    def feasible(self, attributes):
+        # Checked on partial spells, so only attributes that can't recover
+        # once set are looked at: ranges only ever shrink and a material
+        # is never replaced.
+        if self.min_range is not None and attributes.get("range", self.min_range) < self.min_range:
             return False
-        if attributes.get("range", 0) != 1.5 or attributes.get("AOE_radius", 0) != 0:
-            return False
-        base_damage = attributes.get("base_damage", 0)
-        if base_damage > 3 or base_damage < 1:
+        if self.materials is not None and "material" in attributes and attributes["material"] not in self.materials:
             return False
         return True
-    return random_spell_with_constraints(is_valid)
 
-def random_small_heal():
-    def is_valid(spell):
-        if len(spell.tokens) > 6:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("targets_caster", False):
-            return False
-        if attributes.get("AOE_radius", 0) > 0:
-            return False
-        base_damage = attributes.get("base_damage", 0)
-        if base_damage < -10 or base_damage > -1:
-            return False
-        return True
-    return random_spell_with_constraints(is_valid)
+    def checks(self, attributes):
+        """Yield `(keys, passed)` for every limit, `keys` being what it reads."""
+        spell_range = attributes.get("range", 0)
+        radius = attributes.get("AOE_radius", 0)
+        damage = attributes.get("base_damage", 0)
+        for key in self.required:
+            yield ({key}, attributes.get(key, False))
+        if self.min_range is not None:
+            yield ({"range"}, spell_range >= self.min_range)
+        if self.max_range is not None:
+            yield ({"range"}, spell_range <= self.max_range)
+        if self.range_exceeds_radius:
+            yield ({"range", "AOE_radius"}, spell_range > radius)
+        if self.max_radius is not None:
+            yield ({"AOE_radius"}, radius <= self.max_radius)
+        if self.min_damage is not None:
+            yield ({"base_damage"}, damage >= self.min_damage)
+        if self.max_damage is not None:
+            yield ({"base_damage"}, damage <= self.max_damage)
+        if self.materials is not None:
+            yield ({"material"}, attributes.get("material") in self.materials)
 
+    def accepts(self, attributes, size):
+        return size <= self.max_tokens and all(passed for (_, passed) in self.checks(attributes))
 
+    def violated(self, attributes, open_keys):
+        """Whether a limit already fails that none of `open_keys` can still change."""
+        return any(
+            not passed for (keys, passed) in self.checks(attributes)
+            if not keys & open_keys
+        )
 
-def random_large_ranged():
-    def is_valid(spell):
-        if len(spell.tokens) > 12:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("requires_target", False):
-            return False
-        if attributes.get("range", 0) < 14 or attributes.get("range", 0) <= attributes.get("AOE_radius", 0):
-            return False
-        base_damage = attributes.get("base_damage", 0)
-        if base_damage > 50 or base_damage < 10:
-            return False
-        return True
-    return random_spell_with_constraints(is_valid)
 
-def random_large_bump():
-    def is_valid(spell):
-        if len(spell.tokens) > 12:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("requires_target", False):
-            return False
-        if attributes.get("range", 0) != 1.5 or attributes.get("AOE_radius", 0) != 0:
-            return False
-        base_damage = attributes.get("base_damage", 0)
-        if base_damage > 20:
-            return False
-        return True
-    return random_spell_with_constraints(is_valid)
+def is_filter(token):
+    return len(token.inputs) == 1 and token.inputs[0] in token.outputs
 
-def random_large_heal():
-    def is_valid(spell):
-        if len(spell.tokens) > 12:
-            return False
-        attributes = spell.attributes
-        if not attributes.get("targets_caster", False):
-            return False
-        if attributes.get("AOE_radius", 0) > 0:
-            return False
-        base_damage = attributes.get("base_damage", 0)
-        if base_damage < -50 or base_damage > -20:
-            return False
-        return True
-    return random_spell_with_constraints(is_valid)
 
-def random_spell_with_constraints(is_valid_fn, tokens=None):
+class SpellSearch:
+    """Randomized depth-first construction of a spell meeting `constraints`.
+
+    Tokens are placed after their inputs, in the same order `random_spell`
+    builds them, so each token's static attributes are folded in as soon as
+    it is placed and a branch is dropped the moment it can no longer
+    satisfy the constraints or fit in the token budget. Filters (tokens
+    whose input and output share a type) commute and are idempotent, so a
+    chain of them is only explored as a strictly ordered set and shuffled
+    once a spell is found. That keeps the whole space small enough to
+    search exhaustively, which is how impossible constraints are reported.
+    """
+    def __init__(self, constraints, pool, rng):
+        self.constraints = constraints
+        self.rng = rng
+        self.pool = []
+        for token in pool:
+            if not any(token is other for other in self.pool):
+                self.pool.append(token)
+        self.min_size = minimum_sizes(self.pool)
+        (self.writes, self.valueless) = probe_slots(self.pool)
+        self.cost = [
+            1 + sum(self.min_size.get(t, INFINITE_SIZE) for t in token.inputs)
+            for token in self.pool
+        ]
+        self.tokens = []
+        self.connections = []
+        self.values = []
+        self.attributes = {}
+
+    def search(self):
+        for _ in self.solutions():
+            shuffle_filter_chains(self.tokens, self.connections, self.rng)
+            return intern_spell(list(self.tokens), [list(ids) for ids in self.connections])
+        return None
+
+    def solutions(self):
+        """Yield once with the search state holding each accepted spell.
+
+        Without an rng the tokens are tried in pool order, so every spell in
+        the space is visited exactly once, filter chains in canonical order.
+        """
+        if self.min_size.get("sink", INFINITE_SIZE) > self.constraints.max_tokens:
+            return
+        for _ in self.fill("sink", 0, len(self.pool), root=True):
+            if self.constraints.accepts(self.attributes, len(self.tokens)):
+                yield
+
+    def fill(self, slot, reserve, cap, root=False):
+        """Yield once for every way of placing a token that outputs `slot`.
+
+        `reserve` is the number of tokens still owed to unfilled inputs
+        further up, `cap` the rank below which a filter on `slot` must be.
+        """
+        candidates = [
+            (rank, token) for (rank, token) in enumerate(self.pool)
+            if slot in token.outputs
+        ]
+        if self.rng is not None:
+            self.rng.shuffle(candidates)
+        budget = self.constraints.max_tokens - reserve - len(self.tokens)
+        for (rank, token) in candidates:
+            if self.cost[rank] > budget:
+                continue
+            if is_filter(token) and rank >= cap:
+                continue
+            yield from self.place(token, rank, token.inputs, [], reserve, root)
+
+    def place(self, token, rank, inputs, ids, reserve, root=False):
+        if root and all(self.valueless[t] for t in inputs):
+            # Nothing left to build feeds a value into the root token, so
+            # its own contribution can be checked before building the rest.
+            probe = dict(self.attributes)
+            args = [self.values[i] for i in ids] + [None] * sum(t != "caster" for t in inputs)
+            token.infer(probe, *args)
+            open_keys = set()
+            for input_type in inputs:
+                open_keys |= self.writes[input_type]
+            if self.constraints.violated(probe, open_keys):
+                return
+            root = False
+
+        if not inputs:
+            attributes = self.attributes
+            self.attributes = dict(attributes)
+            value = token.infer(self.attributes, *[self.values[i] for i in ids])
+            if self.constraints.feasible(self.attributes):
+                self.tokens.append(token)
+                self.connections.append(ids)
+                self.values.append(value)
+                yield
+                self.tokens.pop()
+                self.connections.pop()
+                self.values.pop()
+            self.attributes = attributes
+            return
+
+        (input_type, rest) = (inputs[0], inputs[1:])
+        if input_type == "caster":
+            yield from self.place(token, rank, rest, ids, reserve, root)
+            return
+        owed = reserve + 1 + sum(self.min_size[t] for t in rest)
+        cap = rank if input_type in token.outputs else len(self.pool)
+        for _ in self.fill(input_type, owed, cap):
+            yield from self.place(token, rank, rest, ids + [len(self.tokens) - 1], reserve, root)
+
+
+INFINITE_SIZE = 1 << 30
+
+def minimum_sizes(pool):
+    """Fewest tokens needed to produce each slot type from `pool`."""
+    sizes = {"caster": 0}
+    changed = True
+    while changed:
+        changed = False
+        for token in pool:
+            size = 1 + sum(sizes.get(t, INFINITE_SIZE) for t in token.inputs)
+            for output in token.outputs:
+                if size < sizes.get(output, INFINITE_SIZE):
+                    sizes[output] = size
+                    changed = True
+    return sizes
+
+def probe_slots(pool):
+    """Find which attributes each slot's subtree may write, and which slots
+    never carry a static value, by inferring every token on empty inputs."""
+    writes = {"caster": set()}
+    valueless = {"caster": True}
+    for token in pool:
+        scratch = {}
+        value = token.infer(scratch, *[None for t in token.inputs if t != "caster"])
+        for output in token.outputs:
+            writes.setdefault(output, set()).update(scratch)
+            valueless[output] = valueless.get(output, True) and value is None
+    changed = True
+    while changed:
+        changed = False
+        for token in pool:
+            for output in token.outputs:
+                for input_type in token.inputs:
+                    missing = writes.get(input_type, set()) - writes[output]
+                    if missing:
+                        writes[output] |= missing
+                        changed = True
+    return (writes, valueless)
+
+def shuffle_filter_chains(tokens, connections, rng):
+    """Shuffle each run of chained filters in place.
+
+    A run is a stretch of filters that each consume the token right before
+    them, so any order of its members leaves the connections valid.
+    """
+    start = 0
+    while start < len(tokens):
+        end = start
+        while end < len(tokens) and is_filter(tokens[end]) and connections[end] == [end - 1]:
+            end += 1
+        if end - start > 1:
+            run = tokens[start:end]
+            rng.shuffle(run)
+            tokens[start:end] = run
+        start = max(end, start + 1)
+
+
+# (constraints key, token pool) pairs that were searched exhaustively
+# without finding a spell.
+IMPOSSIBLE = set()
+
+def random_spell_with_constraints(constraints, tokens=None, rng=None):
     if tokens is None:
-        tokens = [t() for t in all_tokens()]
-
-    spell = None
-    remaining_tries = 5000
-    cache = set()
-    while not spell or not is_valid_fn(spell):
-        if remaining_tries <= 0:
-            return None
-        spell = random_spell(tokens, cache)
-        remaining_tries -= 1
+        tokens = token_instances()
+    if rng is None:
+        rng = random_module
+
+    key = (constraints.key, frozenset((type(t), t.token_id) for t in tokens))
+    if key in IMPOSSIBLE:
+        return None
+    spell = SpellSearch(constraints, tokens, rng).search()
+    if spell is None:
+        IMPOSSIBLE.add(key)
     return spell
 
 
-def random_spell(all_tokens, cache=None):
+SMALL_RANGED = SpellConstraints(
+    max_tokens=6,
+    required=("requires_target",),
+    min_range=4,
+    range_exceeds_radius=True,
+    min_damage=1,
+    max_damage=3,
+)
+
+SMALL_CONSTRUCTION = SpellConstraints(
+    max_tokens=6,
+    required=("requires_target",),
+    min_range=4,
+    range_exceeds_radius=True,
+    materials=("wall", "screaming elemental void"),
+)
+
+SMALL_SUMMON = SpellConstraints(
+    max_tokens=6,
+    required=("is_summon",),
+)
+
+SMALL_BUMP = SpellConstraints(
+    max_tokens=6,
+    required=("requires_target",),
+    min_range=1.5,
+    max_range=1.5,
+    max_radius=0,
+    min_damage=1,
+    max_damage=3,
+)
+
+SMALL_HEAL = SpellConstraints(
+    max_tokens=6,
+    required=("targets_caster",),
+    max_radius=0,
+    min_damage=-10,
+    max_damage=-1,
+)
+
+LARGE_RANGED = SpellConstraints(
+    max_tokens=12,
+    required=("requires_target",),
+    min_range=14,
+    range_exceeds_radius=True,
+    min_damage=10,
+    max_damage=50,
+)
+
+LARGE_BUMP = SpellConstraints(
+    max_tokens=12,
+    required=("requires_target",),
+    min_range=1.5,
+    max_range=1.5,
+    max_radius=0,
+    max_damage=20,
+)
+
+LARGE_HEAL = SpellConstraints(
+    max_tokens=12,
+    required=("targets_caster",),
+    max_radius=0,
+    min_damage=-50,
+    max_damage=-20,
+)
+
+def random_small_ranged(rng=None):
+    return random_spell_with_constraints(SMALL_RANGED, rng=rng)
+
+def random_small_construction(rng=None):
+    return random_spell_with_constraints(SMALL_CONSTRUCTION, rng=rng)
+
+def random_small_summon(rng=None):
+    return random_spell_with_constraints(SMALL_SUMMON, rng=rng)
+
+def random_small_bump(rng=None):
+    return random_spell_with_constraints(SMALL_BUMP, rng=rng)
+
+def random_small_heal(rng=None):
+    return random_spell_with_constraints(SMALL_HEAL, rng=rng)
+
+def random_large_ranged(rng=None):
+    return random_spell_with_constraints(LARGE_RANGED, rng=rng)
+
+def random_large_bump(rng=None):
+    return random_spell_with_constraints(LARGE_BUMP, rng=rng)
+
+def random_large_heal(rng=None):
+    return random_spell_with_constraints(LARGE_HEAL, rng=rng)
+
+
+def random_spell(all_tokens):
     shuffle(all_tokens)
     sink = None
     for token in all_tokens:
@@ -181,18 +399,53 @@ def random_spell(all_tokens, cache=None):
         fill_inputs(sink, 0)
     except:
         return None
-    return Spell(tokens, connections)
-
-
-def fill_shared_grimoire():
-    SHARED_GRIMOIRE["small_ranged"] = [random_small_ranged() for _ in range(10)]
-    SHARED_GRIMOIRE["small_bump"] = [random_small_bump() for _ in range(10)]
-    SHARED_GRIMOIRE["small_heal"] = [random_small_heal() for _ in range(10)]
-    SHARED_GRIMOIRE["small_summon"] = [random_small_summon() for _ in range(10)]
-    SHARED_GRIMOIRE["large_ranged"] = [random_large_ranged() for _ in range(10)]
-    SHARED_GRIMOIRE["large_bump"] = [random_large_bump() for _ in range(10)]
-    SHARED_GRIMOIRE["large_heal"] = [random_large_heal() for _ in range(10)]
-    SHARED_GRIMOIRE["bump_spell_free"] = Spell(
+    return intern_spell(tokens, connections)
+
+
+GRIMOIRE_CATEGORIES = {
+    "small_ranged": SMALL_RANGED,
+    "small_bump": SMALL_BUMP,
+    "small_heal": SMALL_HEAL,
+    "small_summon": SMALL_SUMMON,
+    "large_ranged": LARGE_RANGED,
+    "large_bump": LARGE_BUMP,
+    "large_heal": LARGE_HEAL,
+}
+SPELLS_PER_CATEGORY = 10
+# New games pick one of this many grimoire seeds, so after a handful of games
+# every grimoire is read back from the on-disk cache. This caps how many
+# different grimoires there are; pass variants=None to fill_shared_grimoire
+# for a fresh, uncached one every game.
+GRIMOIRE_VARIANTS = 32
+
+
+def grimoire_spell(seed, category, index):
+    # Every spell gets its own generator, so a grimoire depends on nothing
+    # but its seed.
+    rng = Random(f"{seed}:{category}:{index}")
+    return random_spell_with_constraints(GRIMOIRE_CATEGORIES[category], rng=rng)
+
+def generate_grimoire(seed):
+    return {
+        category: [grimoire_spell(seed, category, i) for i in range(SPELLS_PER_CATEGORY)]
+        for category in GRIMOIRE_CATEGORIES
+    }
+
+def fill_shared_grimoire(seed=None, variants=GRIMOIRE_VARIANTS):
+    if seed is None and variants is None:
+        # A one-off grimoire, not worth a cache file.
+        grimoire = generate_grimoire(random_module.getrandbits(64))
+    else:
+        if seed is None:
+            seed = random_module.randrange(variants)
+        digest = token_digest(GRIMOIRE_CATEGORIES)
+        grimoire = load_grimoire(seed, digest)
+        if grimoire is None:
+            grimoire = generate_grimoire(seed)
+            save_grimoire(seed, digest, grimoire)
+    SHARED_GRIMOIRE.update(grimoire)
+
+    SHARED_GRIMOIRE["bump_spell_free"] = intern_spell(
         [
             AllActors(),
             MeleeRange(),
@@ -208,7 +461,7 @@ def fill_shared_grimoire():
             [2, 3, 1],
         ]
     )
-    SHARED_GRIMOIRE["squirrel_bump_spell"] = Spell(
+    SHARED_GRIMOIRE["squirrel_bump_spell"] = intern_spell(
         [
             AllActors(),
             MeleeRange(),
@@ -224,7 +477,7 @@ def fill_shared_grimoire():
             [2, 3, 1],
         ]
     )
-    SHARED_GRIMOIRE["avatar_spell"] = Spell(
+    SHARED_GRIMOIRE["avatar_spell"] = intern_spell(
         [
             AllActors(),
             MeleeRange(),
@@ -0,0 +1,105 @@
+from collections import Counter
+import random
+
+from components.magic import intern_spell
+from components.magic.token import token_instances
+from spell_generator import SpellConstraints, SpellSearch
+
+# The attributes spells are bucketed by, on top of their token count.
+INDEX_ATTRIBUTES = (
+    "range",
+    "AOE_radius",
+    "base_damage",
+    "requires_target",
+    "targets_caster",
+    "is_heal",
+    "is_summon",
+    "material",
+)
+
+
+class SpellEntry:
+    def __init__(self, tokens, connections, attributes):
+        self.tokens = tuple(tokens)
+        self.connections = tuple(tuple(ids) for ids in connections)
+        self.attributes = dict(attributes)
+        self.token_counts = Counter(token.token_id for token in self.tokens)
+
+    def castable_from(self, counts):
+        return all(counts.get(token_id, 0) >= need for (token_id, need) in self.token_counts.items())
+
+    def spell(self):
+        return intern_spell(self.tokens, self.connections)
+
+
+class SpellSpace:
+    """Every spell of up to `max_tokens` tokens, bucketed by attributes.
+
+    The spells are enumerated once by an exhaustive `SpellSearch`, which
+    only builds chains of filter tokens in one canonical order, so no two
+    entries differ just by the order of their filters. Picking a spell for
+    some constraints is then a scan over the buckets plus a uniform draw.
+    """
+    def __init__(self, max_tokens=12, tokens=None):
+        if tokens is None:
+            tokens = token_instances()
+        self.max_tokens = max_tokens
+        self.entries = []
+        self.buckets = {}
+        self.matches = {}
+
+        search = SpellSearch(SpellConstraints(max_tokens=max_tokens), tokens, None)
+        for _ in search.solutions():
+            entry = SpellEntry(search.tokens, search.connections, search.attributes)
+            self.entries.append(entry)
+            self.buckets.setdefault(self.bucket_key(entry), []).append(entry)
+
+    @staticmethod
+    def bucket_key(entry):
+        return tuple(entry.attributes.get(key) for key in INDEX_ATTRIBUTES) + (len(entry.tokens),)
+
+    def matching(self, constraints):
+        """Return every entry that meets `constraints`."""
+        matches = self.matches.get(constraints.key)
+        if matches is None:
+            # A bucket can be judged by any one of its entries as long as the
+            # constraints read nothing but indexed attributes.
+            by_bucket = set(constraints.required) <= set(INDEX_ATTRIBUTES)
+            matches = []
+            for bucket in self.buckets.values():
+                if by_bucket:
+                    first = bucket[0]
+                    if constraints.accepts(first.attributes, len(first.tokens)):
+                        matches.extend(bucket)
+                else:
+                    matches.extend(
+                        entry for entry in bucket
+                        if constraints.accepts(entry.attributes, len(entry.tokens))
+                    )
+            self.matches[constraints.key] = matches
+        return matches
+
+    def random_spell(self, constraints, counts=None, rng=None):
+        """Draw a spell meeting `constraints` uniformly, or return None.
+
+        With `counts` (token id to count, like `Inventory.token_counts`)
+        only spells that can be cast from those tokens are drawn from.
+        """
+        if rng is None:
+            rng = random
+        candidates = self.matching(constraints)
+        if counts is not None:
+            candidates = [entry for entry in candidates if entry.castable_from(counts)]
+        if not candidates:
+            return None
+        return rng.choice(candidates).spell()
+
+
+SPELL_SPACES = {}
+
+def spell_space(max_tokens=12):
+    """Return the shared SpellSpace, enumerating it on first use."""
+    space = SPELL_SPACES.get(max_tokens)
+    if space is None:
+        space = SPELL_SPACES[max_tokens] = SpellSpace(max_tokens)
+    return space
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+from tcod.los import bresenham
+
+# Shapes are (xs, ys) pairs of intp arrays, which index a (width, height)
+# map array directly, so carving one is a single masked assignment.
+Cells = Tuple[np.ndarray, np.ndarray]
+
+
+DISC_MASKS = {}
+
+def disc_mask(radius: int) -> np.ndarray:
+    """Return a (2r+1, 2r+1) mask of the cells within `radius` of its center."""
+    mask = DISC_MASKS.get(radius)
+    if mask is None:
+        d = np.arange(-radius, radius + 1)
+        mask = d[:, None] ** 2 + d[None, :] ** 2 <= radius * radius
+        mask.flags.writeable = False
+        DISC_MASKS[radius] = mask
+    return mask
+
+
+def rect(x: int, y: int, width: int, height: int) -> Cells:
+    """The cells of the width x height rectangle with (x, y) as its corner."""
+    xs, ys = np.meshgrid(
+        np.arange(x, x + width, dtype=np.intp),
+        np.arange(y, y + height, dtype=np.intp),
+        indexing="ij",
+    )
+    return (xs.ravel(), ys.ravel())
+
+
+def line(start: Tuple[int, int], end: Tuple[int, int]) -> Cells:
+    """The Bresenham line from `start` to `end`, both included."""
+    points = bresenham(start, end).astype(np.intp)
+    return (points[:, 0], points[:, 1])
+
+
+def l_corridor(start: Tuple[int, int], end: Tuple[int, int], horizontal_first: bool = True) -> Cells:
+    """Two straight lines from `start` to `end` with one corner between."""
+    (x1, y1) = start
+    (x2, y2) = end
+    corner = (x2, y1) if horizontal_first else (x1, y2)
+    (xs1, ys1) = line(start, corner)
+    (xs2, ys2) = line(corner, end)
+    return (np.concatenate((xs1, xs2[1:])), np.concatenate((ys1, ys2[1:])))
+
+
+def disc(center: Tuple[int, int], radius: int) -> Cells:
+    """The cells within `radius` of `center`."""
+    (xs, ys) = np.nonzero(disc_mask(radius))
+    return (xs + (center[0] - radius), ys + (center[1] - radius))
+
+
+def clip(cells: Cells, width: int, height: int) -> Cells:
+    """Drop the cells that fall outside a width x height map."""
+    (xs, ys) = cells
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    if inside.all():
+        return cells
+    return (xs[inside], ys[inside])
+
+
+def stamp(tiles: np.ndarray, cells: Cells, tile: np.ndarray, only: Optional[int] = None) -> int:
+    """Write `tile` to `cells` of `tiles`, returning how many were written.
+
+    With `only` set to a TileLabel, cells currently holding some other
+    kind of tile are left alone.
+    """
+    (xs, ys) = clip(cells, *tiles.shape)
+    if only is not None:
+        keep = tiles["label"][xs, ys] == only
+        xs = xs[keep]
+        ys = ys[keep]
+    tiles[xs, ys] = tile
+    return len(xs)
@@ -0,0 +1,58 @@
+from message_log import MessageEvent, MessageLog
+
+
+def ball_hit(target_id, name="Player"):
+    return MessageEvent(
+        "spell_hit",
+        name,
+        target_id=target_id,
+        outcome="damage",
+        amount=10,
+        damage_type="fire",
+        scale="small",
+        shape="ball",
+    )
+
+
+def logged(*events):
+    log = MessageLog()
+    for event in events:
+        log.add_event(event)
+    return log
+
+
+def test_distinct_targets_merge():
+    log = logged(ball_hit(1, "Orc"), ball_hit(2, "Orc"))
+    [message] = log.messages
+    assert message.event.target_ids == [1, 2]
+    assert message.full_text == "A small ball of fire hits 2 Orcs and deals 10 damage each"
+
+
+def test_same_target_merges_as_repeat_hit():
+    log = logged(ball_hit(1), ball_hit(1))
+    [message] = log.messages
+    assert message.event.target_ids == [1]
+    assert message.full_text == "A small ball of fire hits Player twice and deals 10 damage each time"
+
+
+def test_repeat_hits_among_distinct_targets():
+    log = logged(ball_hit(1, "Orc"), ball_hit(2, "Orc"), ball_hit(1, "Orc"))
+    [message] = log.messages
+    assert message.event.target_ids == [1, 2]
+    assert message.full_text == "A small ball of fire hits 2 Orcs 3 times and deals 10 damage each time"
+
+
+def test_events_do_not_merge_across_turns():
+    log = MessageLog()
+    log.add_event(ball_hit(1))
+    log.new_turn()
+    log.add_event(ball_hit(1))
+    assert [m.full_text for m in log.messages] == [
+        "A small ball of fire hits Player and deals 10 damage",
+    ] * 2
+
+
+def test_merged_summons_count_every_creature():
+    log = logged(MessageEvent("summon", "rat", amount=2), MessageEvent("summon", "rat", amount=2))
+    [message] = log.messages
+    assert message.full_text == "4 rats appear"
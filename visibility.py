@@ -0,0 +1,84 @@
+import numpy as np
+from tcod.map import compute_fov
+
+SIGHT_RADIUS = 8
+
+
+class VisibilityCache:
+    """Answers line of sight queries between actors and map positions.
+
+    The field of view from a position is computed the first time it is asked
+    for and reused until the terrain changes, so any number of queries from a
+    caster that hasn't moved cost a single FOV computation.  The player's
+    view is the map's own `visible` array.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.fovs = {}
+        self.key = None
+
+    def fov_from(self, x, y, radius=SIGHT_RADIUS):
+        """Return (x1, y1, fov) where fov is the visible window at (x1, y1)."""
+        game_map = self.engine.game_map
+        key = (id(game_map), game_map.terrain_version)
+        if key != self.key or len(self.fovs) > 256:
+            self.fovs.clear()
+            self.key = key
+
+        fov = self.fovs.get((x, y, radius))
+        if fov is None:
+            x1 = max(0, x - radius)
+            y1 = max(0, y - radius)
+            x2 = min(game_map.width, x + radius + 1)
+            y2 = min(game_map.height, y + radius + 1)
+            window = compute_fov(
+                game_map.tiles["transparent"][x1:x2, y1:y2],
+                (x - x1, y - y1),
+                radius=radius,
+            )
+            fov = (x1, y1, window)
+            self.fovs[(x, y, radius)] = fov
+        return fov
+
+    def fov_for(self, viewer):
+        if viewer is self.engine.player:
+            return (0, 0, self.engine.game_map.visible)
+        return self.fov_from(viewer.x, viewer.y)
+
+    def visible_mask(self, viewer, xs, ys):
+        """Return which of the positions (xs[i], ys[i]) `viewer` can see."""
+        (x1, y1, fov) = self.fov_for(viewer)
+        xs = np.asarray(xs, dtype=np.intp) - x1
+        ys = np.asarray(ys, dtype=np.intp) - y1
+        inside = (xs >= 0) & (xs < fov.shape[0]) & (ys >= 0) & (ys < fov.shape[1])
+        seen = np.zeros(xs.shape, dtype=bool)
+        seen[inside] = fov[xs[inside], ys[inside]]
+        return seen
+
+    def can_see(self, viewer, x, y):
+        return bool(self.visible_mask(viewer, [x], [y])[0])
+
+    def visible_actors(self, viewer):
+        """Return every living actor other than `viewer` that it can see.
+
+        Dormant mushrooms are not actors yet and are left out, see
+        `visible_targets`.
+        """
+        (actors, xs, ys) = self.engine.game_map.actor_positions()
+        seen = self.visible_mask(viewer, xs, ys)
+        return [a for (a, s) in zip(actors, seen) if s and a is not viewer]
+
+    def visible_targets(self, viewer):
+        """Return the cells of everything `viewer` can see, dormant mushrooms
+        included.
+
+        The mushrooms stay dormant; whatever effect lands on their cell
+        materializes the ones it actually hits.
+        """
+        targets = [(a.x, a.y) for a in self.visible_actors(viewer)]
+        (x1, y1, fov) = self.fov_for(viewer)
+        (w, h) = fov.shape
+        (xs, ys) = np.nonzero(fov & self.engine.game_map.colony.member[x1 : x1 + w, y1 : y1 + h])
+        targets.extend(zip((xs + x1).tolist(), (ys + y1).tolist()))
+        return targets